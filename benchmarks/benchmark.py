@@ -0,0 +1,305 @@
+"""
+REST API Benchmark
+
+Seeds the database with fake customers, drives the service with a mix of
+get, list, create, update and suspend requests from concurrent clients, and
+reports the latency percentiles, throughput and database statements of
+each kind of request. The statements are read from the db metric of the
+Server-Timing header the service adds to every response.
+
+By default it starts the real gunicorn app on a throwaway SQLite database:
+
+  python -m benchmarks.benchmark --customers 1000 --requests 5000
+
+Point it at Postgres with --database-uri, or at a server that is already
+running with --url. The results are written as JSON, by default to
+benchmarks/results/<commit>.json, so runs can be compared across commits.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+
+DEFAULT_MIX = "get=50,list=15,create=15,update=10,suspend=10"
+SEED_CHUNK_SIZE = 500
+BASE_PATH = "/api/customers"
+# The statement count in the Server-Timing header, such as db;dur=1.2;desc="3 queries"
+DB_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+######################################################################
+# SERVER
+######################################################################
+
+
+def start_server(database_uri: str, port: int, workers: int):
+    """Starts the service under gunicorn and waits until it is ready"""
+    env = dict(os.environ, DATABASE_URI=database_uri)
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        [
+            sys.executable, "-m", "gunicorn",
+            "--bind", f"127.0.0.1:{port}",
+            "--workers", str(workers),
+            "--log-level", "warning",
+            "service:app",
+        ],
+        env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {server.returncode}")
+        try:
+            if requests.get(f"{url}/ready", timeout=1).ok:
+                return server, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("gunicorn did not become ready within 30 seconds")
+
+
+def fake_customers(count: int) -> list:
+    """Returns count fake customers made by CustomerFactory, without ids
+
+    Emails must be unique, so they are prefixed with an id of this run.
+    """
+    from tests.factories import CustomerFactory  # pylint: disable=import-outside-toplevel
+
+    run_id = uuid.uuid4().hex[:12]
+    customers = []
+    for customer in CustomerFactory.build_batch(count):
+        data = customer.serialize()
+        del data["id"]
+        data["email"] = f"{run_id}-{data['email']}"
+        customers.append(data)
+    return customers
+
+
+def seed(url: str, customers: list) -> dict:
+    """Creates the customers through the bulk endpoint and returns them by id"""
+    seeded = {}
+    for start in range(0, len(customers), SEED_CHUNK_SIZE):
+        chunk = customers[start:start + SEED_CHUNK_SIZE]
+        resp = requests.post(f"{url}{BASE_PATH}/bulk", json=chunk, timeout=60)
+        resp.raise_for_status()
+        seeded.update((row["id"], chunk[row["index"]]) for row in resp.json()["created"])
+    return seeded
+
+
+######################################################################
+# WORKLOAD
+######################################################################
+
+
+class Workload:
+    """Picks and sends requests of the configured mix"""
+
+    def __init__(self, url: str, seeded: dict, mix: dict, rng: random.Random):
+        self.url = url
+        self.seeded = seeded
+        self.ids = list(seeded)
+        self.customers = list(seeded.values())
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.rng = rng
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _session(self) -> requests.Session:
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def _pick(self):
+        with self.lock:
+            return (
+                self.rng.choices(self.operations, self.weights)[0],
+                self.rng.choice(self.ids),
+                self.rng.choice(self.customers),
+            )
+
+    def run_one(self, _=None) -> tuple:
+        """Sends one request and returns (operation, seconds, ok, statements)"""
+        operation, customer_id, customer = self._pick()
+        session = self._session()
+        start = time.perf_counter()
+        if operation == "get":
+            resp = session.get(f"{self.url}{BASE_PATH}/{customer_id}")
+        elif operation == "list":
+            resp = session.get(f"{self.url}{BASE_PATH}", params={"limit": 100})
+        elif operation == "create":
+            body = dict(customer, email=f"{uuid.uuid4().hex}@benchmark.example")
+            resp = session.post(f"{self.url}{BASE_PATH}", json=body)
+        elif operation == "update":
+            body = dict(self.seeded[customer_id], name=customer["name"])
+            resp = session.put(f"{self.url}{BASE_PATH}/{customer_id}", json=body)
+        elif operation == "suspend":
+            resp = session.put(f"{self.url}{BASE_PATH}/{customer_id}/suspend")
+        else:
+            raise ValueError(f"Unknown operation: {operation}")
+        return operation, time.perf_counter() - start, resp.status_code < 400, db_queries(resp)
+
+
+def db_queries(resp: requests.Response):
+    """Returns the statements the service ran for resp, or None without a Server-Timing header"""
+    match = DB_QUERIES.search(resp.headers.get("Server-Timing", ""))
+    return int(match.group(1)) if match else None
+
+
+######################################################################
+# REPORTING
+######################################################################
+
+
+def percentile(latencies: list, fraction: float) -> float:
+    """Returns the nearest-rank percentile of sorted latencies"""
+    if not latencies:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(latencies)))
+    return latencies[rank - 1]
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    """Returns count, errors, percentiles in ms, throughput and statements per request of samples"""
+    latencies = sorted(seconds for _, seconds, _, _ in samples)
+    queries = [count for _, _, _, count in samples if count is not None]
+    return {
+        "count": len(samples),
+        "errors": sum(1 for _, _, ok, _ in samples if not ok),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "requests_per_second": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+        "max_queries": max(queries, default=None),
+    }
+
+
+def git_commit() -> str:
+    """Returns the commit being benchmarked, or "unknown" outside a work tree"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def parse_mix(text: str) -> dict:
+    """Parses a mix such as "get=50,list=50" into weights by operation"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+######################################################################
+# MAIN
+######################################################################
+
+
+def run(args) -> dict:
+    """Runs the benchmark described by args and returns the report"""
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    server, workdir = None, None
+    url = args.url
+    if url is None:
+        database_uri = args.database_uri
+        if database_uri is None:
+            workdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+            database_uri = f"sqlite:///{workdir.name}/benchmark.db"
+        os.environ["DATABASE_URI"] = database_uri  # read by the factories import
+        server, url = start_server(database_uri, args.port, args.workers)
+    try:
+        customers = fake_customers(args.customers)
+        workload = Workload(url, seed(url, customers), mix, rng)
+        for _ in range(args.warmup):
+            workload.run_one()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            samples = list(pool.map(workload.run_one, range(args.requests)))
+        elapsed = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+        if workdir is not None:
+            workdir.cleanup()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "url": args.url or "gunicorn",
+            "database": "sqlite" if args.url is None and args.database_uri is None else "external",
+            "customers": args.customers,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "workers": args.workers,
+            "mix": mix,
+            "seed": args.seed,
+        },
+        "elapsed_seconds": round(elapsed, 3),
+        "overall": summarize(samples, elapsed),
+        "operations": {
+            name: summarize([sample for sample in samples if sample[0] == name], elapsed)
+            for name in mix
+        },
+    }
+
+
+def main(argv=None):
+    """Parses the command line, runs the benchmark and saves the report"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0].strip())
+    parser.add_argument("--url", help="benchmark a server that is already running")
+    parser.add_argument("--database-uri", help="database for the gunicorn app, a temporary SQLite file by default")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--customers", type=int, default=1000, help="customers to seed")
+    parser.add_argument("--requests", type=int, default=5000, help="requests to measure")
+    parser.add_argument("--warmup", type=int, default=100, help="requests sent before measuring")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weights of get, list, create, update and suspend")
+    parser.add_argument("--seed", type=int, default=42, help="random seed of the workload")
+    parser.add_argument("--output", help="JSON report path, benchmarks/results/<commit>.json by default")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    output = args.output or os.path.join(os.path.dirname(__file__), "results", f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+
+    print(
+        f"{'operation':<10} {'count':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} "
+        f"{'queries':>8}"
+    )
+    for name, stats in list(report["operations"].items()) + [("overall", report["overall"])]:
+        print(
+            f"{name:<10} {stats['count']:>7} {stats['errors']:>7} {stats['p50_ms']:>9} "
+            f"{stats['p95_ms']:>9} {stats['p99_ms']:>9} {stats['requests_per_second']:>9} "
+            f"{str(stats['queries_per_request']):>8}"
+        )
+    print(f"Saved {output}")
+
+
+if __name__ == "__main__":
+    main()
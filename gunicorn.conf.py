@@ -0,0 +1,25 @@
+"""
+Gunicorn configuration
+
+When PROMETHEUS_MULTIPROC_DIR is set every worker writes its metrics to
+that directory, so /metrics reports the whole server instead of whichever
+worker answered the scrape.
+"""
+import os
+import shutil
+
+
+def on_starting(server):  # pylint: disable=unused-argument
+    """Removes the metrics left behind by a previous run"""
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Stops reporting the gauges of a worker that exited"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+
+        multiprocess.mark_process_dead(worker.pid)
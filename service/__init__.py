@@ -8,10 +8,12 @@ import sys
 from flask import Flask
 from flask_restx import Api
 from service import config
-from service.common import log_handlers
+from service.common import log_handlers, metrics
+from service.common.json_provider import FastJSONProvider, output_json
 
 # Create Flask application
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.url_map.strict_slashes = False
 app.config.from_object(config)
 app.config['ERROR_404_HELP'] = False
@@ -29,6 +31,7 @@ api = Api(
         doc='/apidocs',  # default also could use doc='/apidocs/'
         prefix='/api',
     )
+api.representation("application/json")(output_json)
 
 # Dependencies require we import the routes AFTER the Flask app is created
 # pylint: disable=wrong-import-position, wrong-import-order
@@ -38,6 +41,7 @@ from service.common import error_handlers, cli_commands  # noqa: F401, E402
 
 # Set up logging for production
 log_handlers.init_logging(app, "gunicorn.error")
+metrics.init_metrics(app)
 
 app.logger.info(70 * "*")
 app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
@@ -0,0 +1,376 @@
+"""
+Bulk operations for Customer
+
+This module contains the operations that write Customers with set-based
+statements instead of through the session:
+
+- upsert and bulk_upsert: INSERT ... ON CONFLICT (email) DO UPDATE
+- bulk_create: multi-row INSERT, chunk by chunk
+- set_availability: UPDATE ... RETURNING of a single Customer
+- bulk_update and bulk_delete: UPDATE and DELETE of the Customers selected
+  by ids or by a filter
+
+The statements bypass the session, so every operation drops the copies of
+the Customers it wrote from the cache and the identity map.
+"""
+import logging
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError, StatementError
+from service.models import (
+    Customer, DataValidationError, column_values, db, filter_criteria, invalidate, rejected_error
+)
+
+logger = logging.getLogger("flask.app")
+
+# Columns that bulk operations may select on and may write
+BULK_FILTERS = ("name", "phone_number", "available")
+BULK_UPDATABLE = ("name", "address", "email", "password", "phone_number", "available")
+
+# Columns an upsert overwrites when a Customer with the same email exists
+UPSERT_COLUMNS = ("name", "address", "password", "phone_number", "available")
+
+
+def upsert(data: dict):
+    """Creates or updates the Customer with the email in data in one statement
+
+    The row is written with INSERT ... ON CONFLICT (email) DO UPDATE, so
+    re-sending the same Customer never makes a duplicate and there is no
+    window between looking it up and writing it.
+
+    :param data: the Customer to write, as accepted by deserialize()
+    :type data: dict
+
+    :return: the written Customer, detached from the session, and True
+        when it was created rather than updated
+    :rtype: tuple
+
+    """
+    values = dict(column_values(Customer().deserialize(data)), version=1)
+    logger.info("Upserting Customer with email %s", values["email"])
+    statement = _upsert_statement([values]).returning(*Customer.__table__.c)
+    try:
+        row = db.session.execute(statement).mappings().one()
+        db.session.commit()
+    except StatementError as error:
+        db.session.rollback()
+        rejected = rejected_error(error, values["email"])
+        if rejected is None:
+            raise
+        raise rejected from error
+    invalidate([row["id"]])
+    # an update always bumps the version past the 1 of a new row
+    return Customer(**row), row["version"] == 1
+
+
+def set_availability(customer_id: int, available: bool):
+    """Suspends or activates a Customer with a single UPDATE ... RETURNING
+
+    The row is changed in one statement, without reading it first, so
+    there is no window for a concurrent writer to race with.
+
+    :param customer_id: the id of the Customer to change
+    :type customer_id: int
+    :param available: False to suspend the Customer, True to activate it
+    :type available: bool
+
+    :return: the changed Customer, detached from the session, or None if
+        there is no Customer with that id
+    :rtype: Customer
+
+    """
+    logger.info("Setting availability of id %s to %s", customer_id, available)
+    table = Customer.__table__
+    statement = (
+        db.update(table)
+        .where(table.c.id == customer_id)
+        .values(available=available, version=table.c.version + 1)
+        .returning(*table.c)
+    )
+    row = db.session.execute(statement).mappings().first()
+    db.session.commit()
+    if row is None:
+        return None
+    invalidate([customer_id])
+    return Customer(**row)
+
+
+def bulk_create(rows, chunk_size: int = 500):
+    """Creates many Customers with one multi-row INSERT per chunk
+
+    Every row is validated with deserialize() first. Rows that fail
+    validation, or that the database rejects, are reported back with the
+    reason instead of aborting the rest of the batch. A chunk the database
+    rejects is inserted again one row at a time.
+
+    :param rows: the dictionaries to create Customers from
+    :type rows: list
+    :param chunk_size: the number of rows written per INSERT statement
+    :type chunk_size: int
+
+    :return: the created rows as {"index", "id"} and the failed rows as
+        {"index", "error"}
+    :rtype: tuple
+
+    """
+    logger.info("Bulk creating %d Customers", len(rows))
+    valid, errors = _deserialize(rows)
+    created = []
+    for start in range(0, len(valid), chunk_size):
+        chunk_created, chunk_errors = _insert_chunk(valid[start:start + chunk_size])
+        created.extend(chunk_created)
+        errors.extend(chunk_errors)
+    errors.sort(key=lambda error: error["index"])
+    return created, errors
+
+
+def bulk_upsert(rows, chunk_size: int = 500):
+    """Creates or updates many Customers by email with multi-row upserts
+
+    Every row is validated with deserialize() first. When several rows
+    have the same email only the last one is written, and the earlier
+    ones are reported as errors, since one statement cannot change the
+    same row twice.
+
+    :param rows: the dictionaries to write Customers from
+    :type rows: list
+    :param chunk_size: the number of rows written per statement
+    :type chunk_size: int
+
+    :return: the created and the updated rows as {"index", "id"}, and the
+        failed rows as {"index", "error"}
+    :rtype: tuple
+
+    """
+    logger.info("Bulk upserting %d Customers", len(rows))
+    valid, errors = _deserialize(rows)
+    valid = _last_by_email(valid, errors)
+    created, updated = [], []
+    for start in range(0, len(valid), chunk_size):
+        chunk = valid[start:start + chunk_size]
+        result = _upsert_chunk(chunk)
+        if result is None:
+            errors.extend({"index": index, "error": "Database rejected the row"} for index, _ in chunk)
+            continue
+        # RETURNING does not promise the order of the rows, so match them by email
+        indexes = {values["email"]: index for index, values in chunk}
+        for row in result:
+            target = created if row.version == 1 else updated
+            target.append({"index": indexes[row.email], "id": row.id})
+    for report in (created, updated, errors):
+        report.sort(key=lambda item: item["index"])
+    return created, updated, errors
+
+
+def bulk_update(values: dict, ids=None, filters=None, returning=False, chunk_size=500):
+    """Updates every selected Customer with set-based UPDATE statements
+
+    Customers are selected either by a list of ids, written chunk_size
+    ids per statement, or by filters in a single statement, which match
+    the same Customers as in Customer.query_by().
+
+    :param values: the column values to write
+    :type values: dict
+    :param ids: the ids of the Customers to update
+    :type ids: list
+    :param filters: column values the Customers to update must match
+    :type filters: dict
+    :param returning: True to also return the ids that were updated
+    :type returning: bool
+
+    :return: the number of Customers updated and their ids, or None when
+        returning is False
+    :rtype: tuple
+
+    """
+    _check_values(values, ids, filters)
+    logger.info("Bulk updating Customers with %s", values)
+    table = Customer.__table__
+    count, updated_ids = 0, []
+    try:
+        for criteria in _criteria(ids, filters, chunk_size):
+            statement = db.update(table).where(criteria).values(version=table.c.version + 1, **values)
+            if returning:
+                chunk_ids = db.session.execute(statement.returning(table.c.id)).scalars().all()
+                updated_ids.extend(chunk_ids)
+                count += len(chunk_ids)
+            else:
+                count += db.session.execute(statement).rowcount
+        db.session.commit()
+    except StatementError as error:
+        db.session.rollback()
+        rejected = rejected_error(error, values.get("email"))
+        if rejected is None:
+            raise
+        raise rejected from error
+    invalidate(ids or None)
+    return count, (updated_ids if returning else None)
+
+
+def bulk_delete(ids=None, filters=None, dry_run=False, chunk_size=500):
+    """Deletes every selected Customer with set-based DELETE statements
+
+    :param ids: the ids of the Customers to delete
+    :type ids: list
+    :param filters: column values the Customers to delete must match
+    :type filters: dict
+    :param dry_run: True to only count the Customers that would be deleted
+    :type dry_run: bool
+
+    :return: the number of Customers deleted, or that would be deleted
+    :rtype: int
+
+    """
+    logger.info("Bulk deleting Customers (dry run: %s)", dry_run)
+    table = Customer.__table__
+    count = 0
+    try:
+        for criteria in _criteria(ids, filters, chunk_size):
+            if dry_run:
+                statement = db.select(db.func.count()).select_from(table).where(criteria)
+                count += db.session.execute(statement).scalar()
+            else:
+                count += db.session.execute(db.delete(table).where(criteria)).rowcount
+    except StatementError as error:
+        db.session.rollback()
+        rejected = rejected_error(error, None)
+        if rejected is None:
+            raise
+        raise rejected from error
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+        invalidate(ids or None)
+    return count
+
+
+######################################################################
+#  H E L P E R S
+######################################################################
+
+
+def _deserialize(rows):
+    """Returns the valid rows as (index, column values) and the errors of the others"""
+    valid, errors = [], []
+    for index, data in enumerate(rows):
+        try:
+            customer = Customer().deserialize(data)
+        except DataValidationError as error:
+            errors.append({"index": index, "error": str(error)})
+            continue
+        valid.append((index, dict(column_values(customer), version=1)))
+    return valid, errors
+
+
+def _last_by_email(valid, errors):
+    """Returns the last valid row for each email, reporting the replaced ones in errors"""
+    by_email = {}
+    for index, values in valid:
+        if values["email"] in by_email:
+            errors.append({"index": by_email[values["email"]][0], "error": "Replaced by a later row"})
+        by_email[values["email"]] = (index, values)
+    return sorted(by_email.values(), key=lambda item: item[0])
+
+
+def _insert_chunk(chunk):
+    """Inserts a chunk of rows with one INSERT, or one by one if it is rejected"""
+    table = Customer.__table__
+    statement = db.insert(table).values([values for _, values in chunk]).returning(table.c.id)
+    try:
+        ids = db.session.execute(statement).scalars().all()
+        db.session.commit()
+    except SQLAlchemyError as error:
+        db.session.rollback()
+        logger.warning("Bulk insert of %d Customers failed, inserting them one by one: %s", len(chunk), error)
+        return _insert_each(chunk)
+    return [{"index": index, "id": new_id} for (index, _), new_id in zip(chunk, ids)], []
+
+
+def _insert_each(chunk):
+    """Inserts the rows of a rejected chunk one at a time, each in a savepoint
+
+    Only the rows the database rejects are lost, and each is reported
+    with the reason, such as an email that already exists.
+    """
+    table = Customer.__table__
+    created, errors = [], []
+    for index, values in chunk:
+        statement = db.insert(table).values(values).returning(table.c.id)
+        try:
+            with db.session.begin_nested():
+                new_id = db.session.execute(statement).scalar_one()
+        except StatementError as error:
+            rejected = rejected_error(error, values["email"])
+            errors.append({"index": index, "error": str(rejected or "Database rejected the row")})
+            continue
+        created.append({"index": index, "id": new_id})
+    db.session.commit()
+    return created, errors
+
+
+def _upsert_chunk(chunk):
+    """Upserts a chunk of rows, returning their id, email and version, or None if rejected"""
+    table = Customer.__table__
+    statement = _upsert_statement([values for _, values in chunk]).returning(
+        table.c.id, table.c.email, table.c.version
+    )
+    try:
+        result = db.session.execute(statement).all()
+        db.session.commit()
+    except SQLAlchemyError as error:
+        db.session.rollback()
+        logger.error("Bulk upsert of %d Customers failed: %s", len(chunk), error)
+        return None
+    invalidate([row.id for row in result])
+    return result
+
+
+def _upsert_statement(rows: list):
+    """Returns the INSERT ... ON CONFLICT (email) DO UPDATE of rows"""
+    # init_db() only accepts these SUPPORTED_DIALECTS
+    dialect = {"postgresql": postgresql, "sqlite": sqlite}[db.engine.dialect.name]
+    table = Customer.__table__
+    statement = dialect.insert(table).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.email],
+        set_=dict(
+            {name: statement.excluded[name] for name in UPSERT_COLUMNS},
+            version=table.c.version + 1,
+        ),
+    )
+
+
+def _check_values(values, ids, filters):
+    """Raises a DataValidationError unless values can be written by bulk_update()"""
+    unknown = set(values or {}) - set(BULK_UPDATABLE)
+    if not values or unknown:
+        raise DataValidationError(
+            f"Invalid update: values must be some of {', '.join(BULK_UPDATABLE)}"
+        )
+    required = sorted(
+        name for name, value in values.items() if value is None and not Customer.__table__.c[name].nullable
+    )
+    if required:
+        raise DataValidationError(f"Invalid update: {', '.join(required)} cannot be null")
+    # emails are unique, so one can only be written to a single Customer
+    if "email" in values and (filters or len(ids or []) != 1):
+        raise DataValidationError("Invalid update: email can only be written to a single id")
+
+
+def _criteria(ids=None, filters=None, chunk_size=500):
+    """Returns the WHERE criteria for each statement of a bulk operation"""
+    if ids and filters:
+        raise DataValidationError("Invalid selection: give either ids or a filter, not both")
+    if ids:
+        return [
+            Customer.id.in_(ids[start:start + chunk_size])
+            for start in range(0, len(ids), chunk_size)
+        ]
+    if filters:
+        unknown = set(filters) - set(BULK_FILTERS)
+        if unknown:
+            raise DataValidationError(
+                f"Invalid filter: must be some of {', '.join(BULK_FILTERS)}"
+            )
+        return [db.and_(*filter_criteria(filters))]
+    raise DataValidationError("Invalid selection: ids or a filter is required")
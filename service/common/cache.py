@@ -0,0 +1,263 @@
+"""
+Cache
+
+This module contains the caches that can sit in front of the database:
+
+- LRUCache: a bounded in-process cache with least recently used eviction
+  and a time to live for every entry
+- RedisCache: a cache shared by every worker through a Redis-protocol
+  server, which publishes invalidations so each worker drops its local copy
+- Cache: the object the models use, which delegates to whichever of the
+  above is selected by the CACHE_BACKEND setting
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+logger = logging.getLogger("flask.app")
+
+# Seconds between attempts to subscribe to the invalidation channel
+RESUBSCRIBE_AFTER = 1.0
+
+
+class LRUCache:
+    """A thread-safe LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value cached for key, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Caches value under key, evicting the least recently used entries"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """Removes key from the cache if it is there"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes every entry from the cache"""
+        with self._lock:
+            self._entries.clear()
+
+    def close(self):
+        """Releases the cache, nothing to do for a local cache"""
+
+    def stats(self) -> dict:
+        """Returns the size of the cache and its hit, miss and eviction counters"""
+        with self._lock:
+            return {
+                "backend": "local",
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class RedisCache:
+    """A cache shared through a Redis-protocol server
+
+    Values are stored as JSON with a time to live, behind a small LRUCache
+    in each worker. Every delete or clear is published on a channel that all
+    workers subscribe to, so they drop their local copies within
+    milliseconds. If the server cannot be reached the cache degrades to the
+    local LRUCache instead of failing the request.
+
+    The client options, such as socket_timeout and socket_connect_timeout,
+    are passed on to redis.Redis.from_url(). Without them a server that
+    stops answering blocks the request for as long as the kernel allows.
+    """
+
+    def __init__(self, url: str, maxsize: int = 1024, ttl: float = 60.0, prefix: str = "customers", **client_options):
+        if redis is None:
+            raise RuntimeError("The redis package is required for the redis cache backend")
+        self.ttl = ttl
+        self.prefix = prefix
+        self.channel = f"{prefix}:invalidate"
+        self.local = LRUCache(maxsize, ttl)
+        self.client = redis.Redis.from_url(url, **client_options)
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        # the listener subscribes, so a server that is down does not stop
+        # the service from starting
+        self._stopped = threading.Event()
+        self._listener = threading.Thread(target=self._listen, name="cache-invalidations", daemon=True)
+        self._listener.start()
+
+    @property
+    def listening(self) -> bool:
+        """True while the listener for invalidations is running"""
+        return self._listener.is_alive()
+
+    def _key(self, key) -> str:
+        return f"{self.prefix}:{key}"
+
+    def _listen(self):
+        """Subscribes to the invalidation channel and handles its messages
+
+        While the server cannot be reached the subscription is retried every
+        RESUBSCRIBE_AFTER seconds. Once subscribed, redis-py subscribes again
+        by itself on the next read after a lost connection.
+        """
+        while not self._stopped.is_set():
+            try:
+                if not self.pubsub.subscribed:
+                    self.pubsub.subscribe(**{self.channel: self._on_invalidate})
+                    # copies taken before now may have missed invalidations
+                    self.local.clear()
+                self.pubsub.get_message(timeout=0.1)
+            except (redis.RedisError, OSError, ValueError) as error:
+                if self._stopped.is_set():
+                    return
+                self._on_listener_error(error)
+                self._stopped.wait(RESUBSCRIBE_AFTER)
+
+    def _on_invalidate(self, message):
+        """Drops the local copy named by an invalidation message"""
+        key = json.loads(message["data"])
+        if key is None:
+            self.local.clear()
+        else:
+            self.local.delete(key)
+
+    def _on_listener_error(self, error):
+        """Drops every local copy, since invalidations may have been missed"""
+        logger.warning("Lost cache invalidation channel: %s", error)
+        self.local.clear()
+
+    def _publish(self, key):
+        self.client.publish(self.channel, json.dumps(key))
+
+    def get(self, key):
+        """Returns the value cached for key locally or on the server"""
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        try:
+            data = self.client.get(self._key(key))
+        except redis.RedisError as error:
+            logger.warning("Cache server unavailable: %s", error)
+            return None
+        if data is None:
+            return None
+        value = json.loads(data)
+        self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        """Caches value under key locally and on the server"""
+        self.local.set(key, value)
+        try:
+            self.client.set(self._key(key), json.dumps(value), ex=max(1, int(self.ttl)))
+        except redis.RedisError as error:
+            logger.warning("Cache server unavailable: %s", error)
+
+    def delete(self, key):
+        """Removes key everywhere and tells every worker to drop it"""
+        self.local.delete(key)
+        try:
+            self.client.delete(self._key(key))
+            self._publish(key)
+        except redis.RedisError as error:
+            logger.warning("Cache server unavailable: %s", error)
+
+    def clear(self):
+        """Removes every entry everywhere and tells every worker to drop them"""
+        self.local.clear()
+        try:
+            keys = list(self.client.scan_iter(match=self._key("*")))
+            if keys:
+                self.client.delete(*keys)
+            self._publish(None)
+        except redis.RedisError as error:
+            logger.warning("Cache server unavailable: %s", error)
+
+    def close(self):
+        """Stops listening for invalidations and closes the connections"""
+        self._stopped.set()
+        self._listener.join(timeout=1)
+        self.pubsub.close()
+        self.client.close()
+
+    def stats(self) -> dict:
+        """Returns the counters of the local cache in front of the server"""
+        return dict(self.local.stats(), backend="redis")
+
+
+class Cache:
+    """The cache used by the models, backed by the configured backend"""
+
+    def __init__(self):
+        self.backend = LRUCache()
+
+    def init_app(self, app):
+        """Selects and sizes the backend from the Flask app config"""
+        self.backend.close()
+        maxsize = app.config.get("CACHE_MAX_ENTRIES", 0)
+        ttl = app.config.get("CACHE_TTL", 0)
+        if app.config.get("CACHE_BACKEND", "local") == "redis":
+            timeout = app.config.get("CACHE_REDIS_TIMEOUT", 0.5)
+            self.backend = RedisCache(
+                app.config["CACHE_REDIS_URL"], maxsize, ttl, socket_timeout=timeout, socket_connect_timeout=timeout
+            )
+        else:
+            self.backend = LRUCache(maxsize, ttl)
+
+    def get(self, key):
+        """Returns the value cached for key, or None"""
+        return self.backend.get(key)
+
+    def set(self, key, value):
+        """Caches value under key"""
+        self.backend.set(key, value)
+
+    def delete(self, key):
+        """Removes key from the cache"""
+        self.backend.delete(key)
+
+    def clear(self):
+        """Removes every entry from the cache"""
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        """Returns the counters of the backend"""
+        return self.backend.stats()
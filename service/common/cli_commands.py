@@ -1,8 +1,11 @@
 """
 Flask CLI Command Extensions
 """
+import click
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
 from service import app  # pylint: disable=cyclic-import
-from service.models import db
+from service.models import db, Customer, EMAIL_INDEX, RETIRED_INDEXES, TRIGRAM_EXTENSION
 
 
 ######################################################################
@@ -19,3 +22,89 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to add the columns that were added to an existing table
+# Usage:
+#   flask db-upgrade
+######################################################################
+@app.cli.command("db-upgrade")
+def db_upgrade():
+    """
+    Adds the Customer columns that db.create_all() does not add to a table
+    that already exists. Run it before deploying a version that uses them.
+    """
+    columns = {column["name"] for column in inspect(db.engine).get_columns("customer")}
+    with db.engine.begin() as connection:
+        if "version" not in columns:
+            # every existing row starts at the version of a new Customer
+            connection.execute(text("ALTER TABLE customer ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+
+
+######################################################################
+# Command to build missing indexes on an existing database
+# Usage:
+#   flask db-index
+######################################################################
+@app.cli.command("db-index")
+def db_index():
+    """
+    Builds any Customer indexes that are missing, then drops the ones they
+    replace. On PostgreSQL both are done CONCURRENTLY so writes to the table
+    are not blocked.
+
+    Fails without changing anything while an email belongs to more than one
+    Customer, since the unique email index cannot be built then. The retired
+    indexes are only dropped once the unique email index is valid.
+    """
+    dialect = db.engine.dialect.name
+    concurrently = "CONCURRENTLY " if dialect == "postgresql" else ""
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        duplicates = connection.execute(
+            text("SELECT email FROM customer GROUP BY email HAVING COUNT(*) > 1 ORDER BY email")
+        ).scalars().all()
+        if duplicates:
+            raise click.ClickException(
+                f"Cannot build {EMAIL_INDEX}: {len(duplicates)} emails belong to more than one "
+                f"Customer, such as {', '.join(duplicates[:5])}. Merge them and run db-index again."
+            )
+        if dialect == "postgresql":
+            connection.execute(TRIGRAM_EXTENSION)
+            # a failed CREATE INDEX CONCURRENTLY leaves an invalid index behind,
+            # which IF NOT EXISTS would keep, so it is dropped and built again
+            if email_index_valid(connection) is False:
+                connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {EMAIL_INDEX}"))
+        create_indexes(connection, dialect)
+        if dialect == "postgresql" and not email_index_valid(connection):
+            raise click.ClickException(
+                f"{EMAIL_INDEX} is not valid, so the indexes it replaces were kept. Run db-index again."
+            )
+        for name in RETIRED_INDEXES:
+            connection.execute(text(f"DROP INDEX {concurrently}IF EXISTS {name}"))
+
+
+def create_indexes(connection, dialect):
+    """Creates the Customer indexes of the dialect that do not exist yet"""
+    for index in Customer.__table__.indexes:
+        # skip the indexes that only exist on another database
+        ddl_if = index._ddl_if  # pylint: disable=protected-access
+        if ddl_if is not None and ddl_if.dialect not in (None, dialect):
+            continue
+        index.dialect_options["postgresql"]["concurrently"] = dialect == "postgresql"
+        try:
+            connection.execute(CreateIndex(index, if_not_exists=True))
+        finally:
+            index.dialect_options["postgresql"]["concurrently"] = False
+
+
+def email_index_valid(connection):
+    """Returns whether the unique email index is valid on PostgreSQL, or None if it is missing"""
+    return connection.execute(
+        text(
+            "SELECT pg_index.indisvalid FROM pg_index "
+            "JOIN pg_class ON pg_class.oid = pg_index.indexrelid WHERE pg_class.relname = :name"
+        ),
+        {"name": EMAIL_INDEX},
+    ).scalar()
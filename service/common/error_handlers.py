@@ -19,7 +19,7 @@ Module: error_handlers
 """
 from flask import jsonify
 from service.models import DataValidationError
-from service import app
+from service import app, api
 from . import status
 
 
@@ -32,6 +32,20 @@ def request_validation_error(error):
     return bad_request(error)
 
 
+@api.errorhandler(DataValidationError)
+def api_validation_error(error):
+    """Handles Value Errors from bad data raised inside the REST API
+
+    flask-restx answers exceptions of its Resources itself, so they never
+    reach the app error handlers unless they propagate as in testing.
+    """
+    message = str(error)
+    app.logger.warning(message)
+    return {
+        "status": status.HTTP_400_BAD_REQUEST, "error": "Bad Request", "message": message
+    }, status.HTTP_400_BAD_REQUEST
+
+
 @app.errorhandler(status.HTTP_400_BAD_REQUEST)
 def bad_request(error):
     """Handles bad requests with 400_BAD_REQUEST"""
@@ -86,6 +100,21 @@ def resource_conflict(error):
     )
 
 
+@app.errorhandler(status.HTTP_412_PRECONDITION_FAILED)
+def precondition_failed(error):
+    """Handles failed If-Match preconditions with HTTP_412_PRECONDITION_FAILED"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_412_PRECONDITION_FAILED,
+            error="Precondition Failed",
+            message=message,
+        ),
+        status.HTTP_412_PRECONDITION_FAILED,
+    )
+
+
 # @app.errorhandler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 # def mediatype_not_supported(error):
 #     """Handles unsupported media requests with 415_UNSUPPORTED_MEDIA_TYPE"""
@@ -0,0 +1,83 @@
+"""
+Health
+
+This module contains the readiness check behind the /ready endpoint. It runs
+SELECT 1 on a pool of its own with a single connection, so a probe never
+waits behind the requests using the main pool, and it bounds the check by a
+timeout. The result is cached for a short time so that frequent probes from
+many pods cost next to nothing.
+"""
+import logging
+import math
+import threading
+import time
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger("flask.app")
+
+
+class ReadinessCheck:
+    """Checks that the database answers, caching the result for ttl seconds"""
+
+    def __init__(self, ttl: float = 2.0, timeout: float = 1.0):
+        self.ttl = ttl
+        self.timeout = timeout
+        self._engine = None
+        self._result = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Reads the cache time and timeout from the Flask app config"""
+        self.ttl = app.config.get("READY_CACHE_TTL", self.ttl)
+        self.timeout = app.config.get("READY_TIMEOUT", self.timeout)
+        self.close()
+
+    def close(self):
+        """Closes the connection used by the check and forgets the last result"""
+        with self._lock:
+            if self._engine is not None:
+                self._engine.dispose()
+            self._engine = None
+            self._result = None
+            self._expires = 0.0
+
+    def check(self, url) -> tuple:
+        """Returns (True, None) when the database at url answers, else (False, reason)"""
+        with self._lock:
+            if self._result is None or self._expires <= time.monotonic():
+                self._result = self._ping(url)
+                self._expires = time.monotonic() + self.ttl
+            return self._result
+
+    def _ping(self, url) -> tuple:
+        try:
+            if self._engine is None or self._engine.url != url:
+                if self._engine is not None:
+                    self._engine.dispose()
+                self._engine = self._create_engine(url)
+            with self._engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return True, None
+        except SQLAlchemyError as error:
+            logger.warning("Readiness check failed: %s", error)
+            return False, type(error).__name__
+
+    def _create_engine(self, url):
+        connect_args = {}
+        if url.get_backend_name() == "postgresql":
+            connect_args = {
+                "connect_timeout": max(1, math.ceil(self.timeout)),
+                "options": f"-c statement_timeout={int(self.timeout * 1000)}",
+            }
+        return create_engine(
+            url,
+            poolclass=QueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=self.timeout,
+            pool_pre_ping=False,
+            connect_args=connect_args,
+        )
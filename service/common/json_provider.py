@@ -0,0 +1,130 @@
+"""
+JSON Provider
+
+This module contains the JSON encoding used for every response. It uses
+orjson when it is installed and falls back to the standard library, and it
+can precompile serializers that turn model instances straight into bytes
+without building a marshalled copy first.
+"""
+import dataclasses
+import datetime
+import decimal
+import json
+import operator
+import uuid
+from json.encoder import encode_basestring_ascii
+from flask import make_response
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _default(obj):
+    """Encodes the types that JSON has no representation for"""
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    if dataclasses.is_dataclass(obj):
+        return dataclasses.asdict(obj)
+    if hasattr(obj, "__html__"):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj) -> bytes:
+    """Encodes obj as compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, separators=(",", ":")).encode()
+
+
+def loads(data):
+    """Decodes JSON from str or bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _encode_value(value) -> str:
+    """Encodes one scalar column value for the standard library fallback"""
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    if isinstance(value, int):
+        return str(value)
+    return json.dumps(value, default=_default)
+
+
+class CompiledSerializer:
+    """Serializes objects with a fixed set of scalar attributes to JSON bytes
+
+    The attribute getter and the encoded keys are built once, so encoding an
+    object is a single pass over its attributes.
+    """
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        getter = operator.attrgetter(*self.fields)
+        if len(self.fields) == 1:
+            self._values = lambda obj: (getter(obj),)
+        else:
+            self._values = getter
+        self._keys = [encode_basestring_ascii(field) + ":" for field in self.fields]
+
+    def to_dict(self, obj) -> dict:
+        """Returns the serialized fields of obj as a dictionary"""
+        return dict(zip(self.fields, self._values(obj)))
+
+    def _encode(self, obj) -> str:
+        pairs = zip(self._keys, self._values(obj))
+        return "{" + ",".join(key + _encode_value(value) for key, value in pairs) + "}"
+
+    def one(self, obj) -> bytes:
+        """Encodes a single object"""
+        if orjson is not None:
+            return orjson.dumps(self.to_dict(obj), default=_default)
+        return self._encode(obj).encode()
+
+    def many(self, objs) -> bytes:
+        """Encodes an iterable of objects as a JSON array"""
+        if orjson is not None:
+            return orjson.dumps([self.to_dict(obj) for obj in objs], default=_default)
+        return ("[" + ",".join(self._encode(obj) for obj in objs) + "]").encode()
+
+
+class FastJSONProvider(JSONProvider):
+    """A Flask JSON provider that encodes with orjson when it is available"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype="application/json")
+
+
+def output_json(data, code, headers=None):
+    """Makes a flask-restx response with a JSON encoded body"""
+    resp = make_response(dumps(data) + b"\n", code)
+    resp.headers.extend(headers or {})
+    return resp
+
+
+def json_response(body: bytes, code, headers=None):
+    """Makes a response from an already encoded JSON body"""
+    resp = make_response(body, code)
+    resp.headers.extend(headers or {})
+    resp.headers["Content-Type"] = "application/json"
+    return resp
@@ -0,0 +1,230 @@
+"""
+Metrics
+
+This module contains the instruments used to observe the service:
+
+- Histogram: a thread-safe histogram with cumulative buckets
+- InstrumentedQueuePool: a SQLAlchemy QueuePool that records how long
+  requests wait for a connection and how often they time out
+- pool_stats: a snapshot of the connection pool of an engine
+- init_metrics: records the count, latency and size of every response and
+  the database queries each request made, for the Prometheus /metrics page.
+  It also logs slow and repeated queries with their route and adds a
+  Server-Timing header to every response.
+- QueryCounter: counts the statements executed inside a with block, so
+  tests can hold an endpoint to a query budget
+
+When PROMETHEUS_MULTIPROC_DIR is set before the service starts, every
+gunicorn worker writes its metrics to that directory and render_metrics()
+adds them up, see gunicorn.conf.py.
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter
+import prometheus_client as prometheus
+from flask import current_app, g, has_request_context, request
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger("flask.app")
+
+# Upper bounds, in seconds, of the latency buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the response size buckets, in bytes
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+# Upper bounds of the queries per request buckets
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+LABELS = ("endpoint", "method")
+
+REQUESTS = prometheus.Counter(
+    "http_requests", "Requests served", LABELS + ("status",)
+)
+REQUEST_LATENCY = prometheus.Histogram(
+    "http_request_duration_seconds", "Time to build the response", LABELS, buckets=DEFAULT_BUCKETS
+)
+RESPONSE_SIZE = prometheus.Histogram(
+    "http_response_size_bytes", "Size of the response body", LABELS, buckets=SIZE_BUCKETS
+)
+DB_QUERIES = prometheus.Histogram(
+    "db_queries_per_request", "Statements executed by a request", LABELS, buckets=QUERY_BUCKETS
+)
+DB_QUERY_TIME = prometheus.Histogram(
+    "db_query_duration_seconds_per_request", "Time a request spent in the database", LABELS,
+    buckets=DEFAULT_BUCKETS
+)
+
+
+class Histogram:
+    """Counts observations into buckets and keeps their count and sum"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        """Records one observation"""
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self) -> dict:
+        """Returns the cumulative bucket counts, the count and the sum"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        buckets, running = {}, 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            running += count
+            buckets["+Inf" if bound == float("inf") else repr(bound)] = running
+        return {"buckets": buckets, "count": running, "sum": total}
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that records how long each checkout waited"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_time = Histogram()
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.wait_time.observe(time.perf_counter() - start)
+
+
+def pool_stats(engine) -> dict:
+    """Returns the state of the connection pool of an engine"""
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            max_overflow=pool._max_overflow,  # pylint: disable=protected-access
+            timeout=pool.timeout(),
+        )
+    if isinstance(pool, InstrumentedQueuePool):
+        stats.update(timeouts=pool.timeouts, wait_time=pool.wait_time.snapshot())
+    return stats
+
+
+######################################################################
+# REQUEST METRICS
+######################################################################
+
+
+def init_metrics(app):
+    """Records metrics for every request served by app"""
+    app.before_request(_start_request)
+    app.after_request(_record_request)
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def render_metrics():
+    """Returns the metrics in Prometheus text format and their content type"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = prometheus.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus.REGISTRY
+    return prometheus.generate_latest(registry), prometheus.CONTENT_TYPE_LATEST
+
+
+class QueryCounter:
+    """Counts the statements executed on any engine inside a with block"""
+
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(Engine, "after_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, "after_cursor_execute", self._count)
+
+    def _count(self, conn, cursor, statement, *args):  # pylint: disable=unused-argument
+        self.count += 1
+        self.statements.append(statement)
+
+
+def _start_request():
+    g.request_start = time.perf_counter()
+    g.db_queries = 0
+    g.db_time = 0.0
+    g.db_statements = Counter()
+
+
+def _record_request(response):
+    if "request_start" not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    labels = (request.endpoint or "unmatched", request.method)
+    REQUESTS.labels(*labels, response.status_code).inc()
+    REQUEST_LATENCY.labels(*labels).observe(elapsed)
+    if response.content_length is not None:
+        RESPONSE_SIZE.labels(*labels).observe(response.content_length)
+    DB_QUERIES.labels(*labels).observe(g.db_queries)
+    DB_QUERY_TIME.labels(*labels).observe(g.db_time)
+    response.headers["Server-Timing"] = (
+        f'db;dur={g.db_time * 1000:.1f};desc="{g.db_queries} queries", app;dur={elapsed * 1000:.1f}'
+    )
+    _log_repeated_queries()
+    return response
+
+
+def _log_repeated_queries():
+    """Logs statements that ran often enough in one request to be an N+1"""
+    threshold = current_app.config.get("REPEATED_QUERY_THRESHOLD", 0)
+    if not threshold:
+        return
+    for statement, count in g.db_statements.items():
+        if count >= threshold:
+            logger.warning(
+                "Query repeated %d times in %s %s: %s", count, request.method, request.path, statement[:200]
+            )
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # pylint: disable=unused-argument, too-many-arguments
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # pylint: disable=unused-argument, too-many-arguments
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    if has_request_context() and "db_queries" in g:
+        g.db_queries += 1
+        g.db_time += elapsed
+        g.db_statements[statement] += 1
+        threshold = current_app.config.get("SLOW_QUERY_THRESHOLD", 0)
+        if threshold and elapsed >= threshold:
+            logger.warning(
+                "Slow query took %.1fms in %s %s: %s", elapsed * 1000, request.method, request.path, statement[:200]
+            )
@@ -0,0 +1,154 @@
+"""
+Replica Routing
+
+This module contains the session that spreads reads over read replicas:
+
+- RoutingSession: sends plain SELECTs to the replicas round-robin and keeps
+  everything else, and every read after a write, on the primary. A read
+  that finds its replica unreachable is run again on another replica or the
+  primary
+- ReplicaHealth: remembers which replicas failed recently so they are
+  skipped until they have had time to recover
+
+Replicas are configured as SQLALCHEMY_BINDS whose keys start with "replica_".
+"""
+import itertools
+import logging
+import threading
+import time
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql import Select
+
+logger = logging.getLogger("flask.app")
+
+REPLICA_PREFIX = "replica_"
+
+# Set in session.info once the session must stay on the primary
+PRIMARY = "use_primary"
+
+# Set in session.info to the key of the replica the last statement went to
+REPLICA = "replica"
+
+
+class ReplicaHealth:
+    """Tracks the replicas that failed and when they may be tried again"""
+
+    def __init__(self, retry_after: float = 30.0):
+        self.retry_after = retry_after
+        self._down_until = {}
+        self._lock = threading.Lock()
+
+    def mark_down(self, key: str):
+        """Takes a replica out of rotation for retry_after seconds"""
+        logger.warning("Replica %s is unhealthy, reading from the primary", key)
+        with self._lock:
+            self._down_until[key] = time.monotonic() + self.retry_after
+
+    def is_up(self, key: str) -> bool:
+        """Returns True unless the replica failed within retry_after seconds"""
+        with self._lock:
+            return self._down_until.get(key, 0) <= time.monotonic()
+
+    def reset(self):
+        """Puts every replica back into rotation"""
+        with self._lock:
+            self._down_until.clear()
+
+
+replica_health = ReplicaHealth()
+_next_replica = itertools.count()
+
+
+def watch_replicas(db, retry_after: float = 30.0):
+    """Takes replicas out of rotation when they cannot be reached
+
+    This must be called inside an application context after db.init_app()
+    """
+    replica_health.retry_after = retry_after
+    replica_health.reset()
+    for key, engine in db.engines.items():
+        if key and key.startswith(REPLICA_PREFIX):
+            event.listen(engine, "handle_error", _on_replica_error(key))
+
+
+def _on_replica_error(key: str):
+    def handle_error(context):
+        # connection is None when the connection itself could not be made
+        if context.is_disconnect or context.connection is None:
+            replica_health.mark_down(key)
+    return handle_error
+
+
+class RoutingSession(Session):
+    """A session that reads from a healthy replica when it is safe to
+
+    A statement goes to a replica only when it is a SELECT without FOR
+    UPDATE and the session has not written anything yet, so that a request
+    always reads its own writes. The session goes back to the replicas when
+    use_replicas() is called at the start of the next request, or when it
+    is closed.
+    """
+
+    def use_primary(self):
+        """Keeps every following statement of this session on the primary"""
+        self.info[PRIMARY] = True
+
+    def use_replicas(self):
+        """Lets the following reads of this session go to the replicas again"""
+        self.info.pop(PRIMARY, None)
+
+    def close(self):
+        self.use_replicas()
+        super().close()
+
+    def execute(self, statement, *args, **kwargs):
+        return self._with_failover(super().execute, statement, *args, **kwargs)
+
+    def scalar(self, statement, *args, **kwargs):
+        return self._with_failover(super().scalar, statement, *args, **kwargs)
+
+    def scalars(self, statement, *args, **kwargs):
+        return self._with_failover(super().scalars, statement, *args, **kwargs)
+
+    def _with_failover(self, method, *args, **kwargs):
+        """Calls method, again on another bind each time a replica is found down
+
+        A read on a replica means the session has not written anything, so
+        rolling back before the next try loses nothing.
+        """
+        while True:
+            self.info.pop(REPLICA, None)
+            try:
+                return method(*args, **kwargs)
+            except DBAPIError:
+                key = self.info.pop(REPLICA, None)
+                # handle_error takes a replica that cannot be reached out of rotation
+                if key is None or replica_health.is_up(key):
+                    raise
+                logger.warning("Reading from replica %s failed, trying again elsewhere", key)
+                self.rollback()
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self.info.get(PRIMARY):
+            if isinstance(clause, Select) and clause._for_update_arg is None:  # pylint: disable=protected-access
+                key = self._replica()
+                if key is not None:
+                    self.info[REPLICA] = key
+                    return self._db.engines[key]
+            else:
+                self.use_primary()
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica(self):
+        """Returns the key of the next healthy replica round-robin, or None"""
+        keys = sorted(key for key in self._db.engines if key and key.startswith(REPLICA_PREFIX))
+        if not keys:
+            return None
+        start = next(_next_replica)
+        for offset in range(len(keys)):
+            key = keys[(start + offset) % len(keys)]
+            if replica_health.is_up(key):
+                return key
+        return None
@@ -2,6 +2,7 @@
 Global Configuration for Application
 """
 import os
+from service.common.metrics import InstrumentedQueuePool
 
 # Get configuration from environment
 DATABASE_URI = os.getenv(
@@ -12,5 +13,63 @@ DATABASE_URI = os.getenv(
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool of each worker. Every gunicorn worker opens up to
+# DB_POOL_SIZE + DB_MAX_OVERFLOW connections, so workers x (size + overflow),
+# doubled during a rolling update, must stay below max_connections of Postgres.
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "poolclass": InstrumentedQueuePool,
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "1", "yes"),
+}
+if DATABASE_URI in ("sqlite://", "sqlite:///:memory:"):
+    # An in-memory SQLite database lives in a single shared connection
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+
+# Optional read replicas as a comma separated list of database URIs. Plain
+# reads are spread over them round-robin, a replica that cannot be reached
+# is skipped for DATABASE_REPLICA_RETRY_AFTER seconds.
+DATABASE_REPLICA_URIS = [
+    uri.strip() for uri in os.getenv("DATABASE_REPLICA_URIS", "").split(",") if uri.strip()
+]
+SQLALCHEMY_BINDS = {f"replica_{index}": uri for index, uri in enumerate(DATABASE_REPLICA_URIS)}
+DATABASE_REPLICA_RETRY_AFTER = float(os.getenv("DATABASE_REPLICA_RETRY_AFTER", "30"))
+
+# The result of the database check behind /ready is reused for
+# READY_CACHE_TTL seconds, and the check gives up after READY_TIMEOUT seconds
+READY_CACHE_TTL = float(os.getenv("READY_CACHE_TTL", "2"))
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", "1"))
+
+# Queries slower than SLOW_QUERY_THRESHOLD seconds, and statements run at
+# least REPEATED_QUERY_THRESHOLD times by one request (an N+1 pattern), are
+# logged with the route that ran them. Set either to 0 to turn it off.
+SLOW_QUERY_THRESHOLD = float(os.getenv("SLOW_QUERY_THRESHOLD", "0.5"))
+REPEATED_QUERY_THRESHOLD = int(os.getenv("REPEATED_QUERY_THRESHOLD", "10"))
+
+# Number of rows fetched per round trip when streaming the export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Number of rows written per multi-row INSERT by the bulk create endpoint
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))
+
+# Read-through cache in front of Customer.find. A cached Customer costs
+# roughly 2KB, so the default 5000 entries stay near 10MB, well inside the
+# 64Mi limit of a pod. Set CACHE_MAX_ENTRIES to 0 to disable the cache.
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "5000"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "30"))
+
+# Set CACHE_BACKEND to "redis" to share the cache between workers and
+# replicas through CACHE_REDIS_URL, with invalidations published to all
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "local")
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+# Seconds to wait for the cache server to connect or answer before the
+# request falls back to the local cache
+CACHE_REDIS_TIMEOUT = float(os.getenv("CACHE_REDIS_TIMEOUT", "0.5"))
+
+# Seconds the counts of /api/customers/stats are reused, 0 to always count
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "5"))
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
@@ -2,13 +2,64 @@
 Models for Customer
 All of the models are stored in this module
 """
+import base64
+import binascii
+import functools
 import logging
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event, inspect, literal_column
+from sqlalchemy.exc import DBAPIError, IntegrityError, StatementError
+from sqlalchemy.orm import load_only, make_transient_to_detached
+from sqlalchemy.orm.exc import StaleDataError
+from service.common.cache import Cache, LRUCache
+from service.common.json_provider import CompiledSerializer
+from service.common.routing import RoutingSession, watch_replicas
 
 logger = logging.getLogger("flask.app")
 
-# Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+# Page sizes used by keyset pagination
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Columns the list endpoint may filter and sort on
+QUERY_FILTERS = ("id", "name", "email", "address", "phone_number", "available")
+QUERY_SORTS = ("id", "name", "email", "phone_number", "available")
+
+# Number of results search() returns by default and at most, and the
+# shortest query it accepts, since trigram indexes need three characters
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+MIN_SEARCH_LENGTH = 3
+SEARCH_SEPARATOR = literal_column("' '")
+
+# Indexes that were replaced under another name, dropped by flask db-index:
+# ix_customer_email was not unique, so CREATE ... IF NOT EXISTS kept it
+RETIRED_INDEXES = ("ix_customer_email",)
+
+# The databases the service runs on: upsert() needs INSERT ... ON CONFLICT
+SUPPORTED_DIALECTS = ("postgresql", "sqlite")
+
+# The unique index on email, and the SQLSTATE PostgreSQL reports it with
+EMAIL_INDEX = "ix_customer_email_unique"
+UNIQUE_VIOLATION = "23505"
+
+# Create the SQLAlchemy object to be initialized later in init_db(). The
+# session keeps what it wrote after a commit instead of reading it back:
+# create() gets the id from INSERT ... RETURNING and the version column is
+# set by the ORM itself, so a Customer is complete after it is written.
+db = SQLAlchemy(session_options={"class_": RoutingSession, "expire_on_commit": False})
+
+# Cache of Customer column values by id, configured in init_db()
+customer_cache = Cache()
+
+# The counts returned by customer_stats(), kept for STATS_CACHE_TTL seconds
+stats_cache = LRUCache(maxsize=1, ttl=5)
+
+# The fields of a serialized Customer, in the order they are written
+SERIALIZED_FIELDS = ("id", "name", "address", "email", "phone_number", "password", "available")
+
+# Encodes Customers straight to JSON bytes for the API responses
+customer_serializer = CompiledSerializer(SERIALIZED_FIELDS)
 
 
 # Function to initialize the database
@@ -21,6 +72,149 @@ class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+class VersionConflictError(Exception):
+    """Used when a Customer was changed by someone else since it was read"""
+
+
+class UnsupportedDatabaseError(Exception):
+    """Used when the database is not one of the SUPPORTED_DIALECTS"""
+
+
+class DuplicateEmailError(Exception):
+    """Used when a Customer would have the same email as another Customer"""
+
+
+def is_duplicate_email(error: IntegrityError) -> bool:
+    """Returns True when error is a violation of the unique index on email"""
+    diag = getattr(error.orig, "diag", None)
+    if diag is not None:  # psycopg2 names the violated constraint
+        return error.orig.pgcode == UNIQUE_VIOLATION and diag.constraint_name == EMAIL_INDEX
+    return "UNIQUE constraint failed: customer.email" in str(error.orig)
+
+
+def rejected_error(error: StatementError, email: str):
+    """Returns the error to raise for a Customer the database rejected
+
+    :param error: the error of the statement that wrote the Customer
+    :type error: StatementError
+    :param email: the email of the Customer
+    :type email: str
+
+    :return: a DuplicateEmailError or a DataValidationError, or None when the
+        database failed rather than rejected the data
+    :rtype: Exception
+
+    """
+    if isinstance(error, IntegrityError):
+        if is_duplicate_email(error):
+            return DuplicateEmailError(f"A Customer with email '{email}' already exists.")
+    elif isinstance(error, DBAPIError):
+        return None
+    return DataValidationError(f"Invalid Customer: {error.orig}")
+
+
+def invalidate(ids=None):
+    """Drops stale copies of the given ids, or of every Customer when ids is None
+
+    Set-based statements bypass the session, which does not expire its
+    objects on commit, so their copies in the identity map are expired
+    along with the cache entries.
+    """
+    if ids is None:
+        customer_cache.clear()
+        db.session.expire_all()
+        return
+    for customer_id in ids:
+        customer_cache.delete(customer_id)
+        customer = db.session.identity_map.get(db.session.identity_key(Customer, customer_id))
+        if customer is not None:
+            db.session.expire(customer)
+
+
+def column_values(customer) -> dict:
+    """Returns the column values of a Customer, without its id, for INSERT"""
+    return {
+        column.name: getattr(customer, column.name)
+        for column in customer.__table__.columns
+        if column.name != "id"
+    }
+
+
+def filter_criteria(filters: dict) -> list:
+    """Returns the WHERE criteria of the Customers whose columns equal filters
+
+    Names match ignoring case. Raises a DataValidationError for a value the
+    column cannot hold, such as an available that is not a boolean.
+    """
+    criteria = []
+    for name, value in filters.items():
+        python_type = Customer.__table__.c[name].type.python_type
+        # bool is a subclass of int, but True is not an id
+        if not isinstance(value, python_type) or (isinstance(value, bool) and python_type is not bool):
+            raise DataValidationError(f"Invalid filter: {name} must be a {python_type.__name__}")
+        if name == "name":
+            criteria.append(db.func.lower(Customer.name) == value.lower())
+        else:
+            criteria.append(getattr(Customer, name) == value)
+    return criteria
+
+
+def check_dialect(engine):
+    """Raises an UnsupportedDatabaseError unless engine is one of the SUPPORTED_DIALECTS"""
+    if engine.dialect.name not in SUPPORTED_DIALECTS:
+        raise UnsupportedDatabaseError(
+            f"Unsupported database {engine.dialect.name}: must be one of {', '.join(SUPPORTED_DIALECTS)}"
+        )
+
+
+def parse_fields(text: str) -> tuple:
+    """Parses a comma separated list of field names for a sparse fieldset
+
+    :param text: the requested field names, such as "name,available"
+    :type text: str
+
+    :return: the requested fields in serialized order, always including id
+    :rtype: tuple
+
+    """
+    requested = {name.strip() for name in text.split(",") if name.strip()}
+    unknown = requested - set(SERIALIZED_FIELDS)
+    if unknown:
+        raise DataValidationError(f"Invalid fields: {', '.join(sorted(unknown))}")
+    return tuple(name for name in SERIALIZED_FIELDS if name in requested or name == "id")
+
+
+@functools.lru_cache(maxsize=None)
+def serializer_for(fields: tuple) -> CompiledSerializer:
+    """Returns the serializer for a sparse fieldset, compiling it once"""
+    return CompiledSerializer(fields)
+
+
+def encode_cursor(last_id: int) -> str:
+    """Encodes the id of the last row on a page into an opaque cursor"""
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """Decodes an opaque cursor back into the id it points after
+
+    :param cursor: a cursor previously returned by encode_cursor
+    :type cursor: str
+
+    :return: the id of the last row of the previous page
+    :rtype: int
+
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        prefix, last_id = base64.urlsafe_b64decode(padded).decode().split(":")
+        if prefix != "id":
+            raise ValueError(prefix)
+        return int(last_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as error:
+        raise DataValidationError(f"Invalid cursor: {cursor}") from error
+
+
 class Customer(db.Model):
     """
     Class that represents a Customer
@@ -35,6 +229,37 @@ class Customer(db.Model):
     password = db.Column(db.String(20), nullable=False)
     phone_number = db.Column(db.String(63))
     available = db.Column(db.Boolean(), nullable=False, default=False)
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+
+    # every UPDATE checks and bumps the version, so concurrent writers
+    # are detected without locking the row
+    __mapper_args__ = {"version_id_col": version}
+
+    # The text search() looks in, name, email and address separated by spaces
+    search_document = db.func.lower(
+        name.op("||")(SEARCH_SEPARATOR).op("||")(email).op("||")(SEARCH_SEPARATOR).op("||")(address)
+    )
+
+    # Indexes for the access paths of the find_by_* methods
+    __table_args__ = (
+        db.Index(EMAIL_INDEX, "email", unique=True),
+        db.Index("ix_customer_phone_number", "phone_number"),
+        db.Index("ix_customer_name_lower", db.func.lower(name)),
+        # suspended Customers are the minority, so only they are indexed
+        db.Index(
+            "ix_customer_suspended",
+            "available",
+            postgresql_where=available.is_(False),
+            sqlite_where=available.is_(False),
+        ),
+        # trigram index that answers search() substring matches on PostgreSQL
+        db.Index(
+            "ix_customer_search_trgm",
+            search_document.label("search_document"),
+            postgresql_using="gin",
+            postgresql_ops={"search_document": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+    )
 
     def __repr__(self):
         return f"<Customer {self.name} id=[{self.id}]>"
@@ -46,32 +271,71 @@ class Customer(db.Model):
         logger.info("Creating %s", self.name)
         self.id = None  # pylint: disable=invalid-name
         db.session.add(self)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except StatementError as error:
+            db.session.rollback()
+            rejected = rejected_error(error, self.email)
+            if rejected is None:
+                raise
+            raise rejected from error
+        customer_cache.delete(self.id)
 
     def update(self):
         """
         Updates a Customer to the database
+
+        Raises a VersionConflictError if the Customer was changed by someone
+        else since it was read, a DuplicateEmailError if its email belongs to
+        another Customer, and a DataValidationError for other values the
+        database rejects
         """
-        logger.info("Saving %s", self.name)
-        db.session.commit()
+        with db.session.no_autoflush:  # reading them must not write the changes early
+            logger.info("Saving %s", self.name)
+            customer_id, email = self.id, self.email
+        try:
+            db.session.commit()
+        except StatementError as error:
+            db.session.rollback()
+            rejected = rejected_error(error, email)
+            if rejected is None:
+                raise
+            raise rejected from error
+        except StaleDataError as error:
+            db.session.rollback()
+            customer_cache.delete(customer_id)
+            raise VersionConflictError(
+                f"Customer with id '{customer_id}' was changed by another request."
+            ) from error
+        customer_cache.delete(customer_id)
+
+    @property
+    def etag(self) -> str:
+        """Returns an entity tag that changes whenever the Customer does"""
+        return f"{self.id}-{self.version}"
 
     def delete(self):
-        """Removes a Customer from the data store"""
+        """Removes a Customer from the data store
+
+        Raises a VersionConflictError if the Customer was changed by someone
+        else since it was read
+        """
         logger.info("Deleting %s", self.name)
+        customer_id = self.id
         db.session.delete(self)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except StaleDataError as error:
+            db.session.rollback()
+            customer_cache.delete(customer_id)
+            raise VersionConflictError(
+                f"Customer with id '{customer_id}' was changed by another request."
+            ) from error
+        customer_cache.delete(customer_id)
 
     def serialize(self):
         """Serializes a Customer into a dictionary"""
-        return {
-            "id": self.id,
-            "name": self.name,
-            "address": self.address,
-            "email": self.email,
-            "phone_number": self.phone_number,
-            "password": self.password,
-            "available": self.available,
-        }
+        return customer_serializer.to_dict(self)
 
     def deserialize(self, data):
         """
@@ -100,73 +364,284 @@ class Customer(db.Model):
 
     @classmethod
     def init_db(cls, app):
-        """Initializes the database session"""
+        """Initializes the database session
+
+        Raises an UnsupportedDatabaseError unless the database is one of the
+        SUPPORTED_DIALECTS, rather than failing on the first upsert
+        """
         logger.info("Initializing database")
         cls.app = app
+        customer_cache.init_app(app)
+        stats_cache.ttl = app.config.get("STATS_CACHE_TTL", stats_cache.ttl)
+        stats_cache.clear()
         # This is where we initialize SQLAlchemy from the Flask app
         db.init_app(app)
         app.app_context().push()
+        check_dialect(db.engine)
+        watch_replicas(db, app.config.get("DATABASE_REPLICA_RETRY_AFTER", 30))
         db.create_all()  # make our sqlalchemy tables
 
     @classmethod
-    def all(cls):
-        """Returns all of the Customers in the database"""
+    def all(cls, fields=None):
+        """Returns all of the Customers in the database
+
+        Args:
+            fields (tuple): only load these fields, see parse_fields()
+        """
         logger.info("Processing all Customers")
-        return cls.query.all()
+        return cls._select(fields).all()
+
+    @classmethod
+    def _select(cls, fields=None):
+        """Returns a query that loads only the given fields, or every column"""
+        if not fields:
+            return cls.query
+        columns = [getattr(cls, name) for name in fields if name != "id"]
+        # the version is always loaded, it is part of the ETag
+        return cls.query.options(load_only(cls.version, *columns))
+
+    @classmethod
+    def query_by(cls, filters=None, sort=None, order="asc", fields=None):
+        """Returns a query for the Customers that match every filter
+
+        The filters are ANDed into a single statement. Names match ignoring
+        case through the index on lower(name), the other columns must match
+        exactly.
+
+        :param filters: column values the Customers must match, see QUERY_FILTERS
+        :type filters: dict
+        :param sort: the column to sort on, see QUERY_SORTS, id when None
+        :type sort: str
+        :param order: "asc" or "desc"
+        :type order: str
+        :param fields: only load these fields, see parse_fields()
+        :type fields: tuple
+
+        :return: the query, ordered by sort and then by id
+        :rtype: Query
+
+        """
+        filters = filters or {}
+        unknown = set(filters) - set(QUERY_FILTERS)
+        if unknown:
+            raise DataValidationError(f"Invalid filters: {', '.join(sorted(unknown))}")
+        sort = sort or "id"
+        if sort not in QUERY_SORTS or order not in ("asc", "desc"):
+            raise DataValidationError(
+                f"Invalid sort: must be one of {', '.join(QUERY_SORTS)}, ordered asc or desc"
+            )
+        logger.info("Processing query for %s sorted by %s %s ...", filters, sort, order)
+        query = cls._select(fields).filter(*filter_criteria(filters))
+        column = getattr(cls, sort)
+        ordering = [column.desc() if order == "desc" else column.asc()]
+        if sort != "id":
+            ordering.append(cls.id.desc() if order == "desc" else cls.id.asc())
+        return query.order_by(*ordering)
+
+    @classmethod
+    def search(cls, text: str, limit: int = DEFAULT_SEARCH_LIMIT, fields=None) -> list:
+        """Returns the Customers whose name, email or address contain every word of text
+
+        Words match anywhere, ignoring case. On PostgreSQL the match is
+        answered by the trigram index on the search document. Customers
+        whose name starts with the text rank first, then those whose email
+        does, then the rest, ordered by how similar their name is on
+        PostgreSQL and by id elsewhere.
+
+        :param text: the words to look for
+        :type text: str
+        :param limit: the maximum number of Customers to return
+        :type limit: int
+        :param fields: only load these fields, see parse_fields()
+        :type fields: tuple
+
+        :return: the best matching Customers, best first
+        :rtype: list
+
+        """
+        term = " ".join(text.lower().split())
+        if len(term) < MIN_SEARCH_LENGTH:
+            raise DataValidationError(
+                f"Invalid search: must be at least {MIN_SEARCH_LENGTH} characters"
+            )
+        if limit < 1 or limit > MAX_SEARCH_LIMIT:
+            raise DataValidationError(
+                f"Invalid limit: must be between 1 and {MAX_SEARCH_LIMIT}"
+            )
+        logger.info("Processing search for %s ...", term)
+        query = cls._select(fields)
+        for word in term.split():
+            query = query.filter(cls.search_document.contains(word, autoescape=True))
+        name, email = db.func.lower(cls.name), db.func.lower(cls.email)
+        ordering = [
+            db.case(
+                (name.startswith(term, autoescape=True), 0),
+                (email.startswith(term, autoescape=True), 1),
+                else_=2,
+            )
+        ]
+        if db.engine.dialect.name == "postgresql":
+            ordering.append(db.func.similarity(name, term).desc())
+        ordering.append(cls.id)
+        return query.order_by(*ordering).limit(limit).all()
 
     @classmethod
-    def find(cls, by_id):
-        """Finds a Customer by its ID"""
+    def count(cls, filters=None) -> int:
+        """Returns how many Customers match every filter, counted by the database
+
+        :param filters: column values the Customers must match, see query_by()
+        :type filters: dict
+
+        :return: the number of matching Customers
+        :rtype: int
+
+        """
+        logger.info("Processing count for %s ...", filters)
+        query = cls.query_by(filters).order_by(None)
+        return query.with_entities(db.func.count(cls.id)).scalar()
+
+    @classmethod
+    def paginate(cls, limit: int, cursor: str = None, fields=None, filters=None):
+        """Returns one page of Customers ordered by id using keyset pagination
+
+        Each page seeks past the last id of the previous one instead of using
+        OFFSET, so the cost of a page does not grow with how deep it is.
+
+        :param limit: the maximum number of Customers to return
+        :type limit: int
+        :param cursor: the opaque cursor returned with the previous page
+        :type cursor: str
+        :param fields: only load these fields, see parse_fields()
+        :type fields: tuple
+        :param filters: column values the Customers must match, see query_by()
+        :type filters: dict
+
+        :return: the Customers on this page and the cursor for the next page,
+            or None when this is the last page
+        :rtype: tuple
+
+        """
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            raise DataValidationError(
+                f"Invalid limit: must be between 1 and {MAX_PAGE_SIZE}"
+            )
+        logger.info("Processing page of %d after cursor %s ...", limit, cursor)
+        query = cls.query_by(filters, fields=fields)
+        if cursor:
+            query = query.filter(cls.id > decode_cursor(cursor))
+        # fetch one extra row to learn whether another page exists
+        customers = query.limit(limit + 1).all()
+        next_cursor = None
+        if len(customers) > limit:
+            customers = customers[:limit]
+            next_cursor = encode_cursor(customers[-1].id)
+        return customers, next_cursor
+
+    @classmethod
+    def find(cls, by_id, fields=None, fresh=False):
+        """Finds a Customer by its ID, reading through the cache
+
+        A Customer loaded with only some fields is not cached.
+
+        Args:
+            by_id (int): the id of the Customer to find
+            fields (tuple): only load these fields, see parse_fields()
+            fresh (bool): read the stored row, never a cached copy
+        """
         logger.info("Processing lookup for id %s ...", by_id)
-        return cls.query.get(by_id)
+        customer = None if fresh else cls._cached(by_id)
+        if customer is not None:
+            return customer
+        if fields:
+            return cls._select(fields).filter(cls.id == by_id).first()
+        customer = db.session.get(cls, by_id, populate_existing=fresh)
+        if customer:
+            customer_cache.set(by_id, {"id": customer.id, **column_values(customer)})
+        return customer
 
     @classmethod
-    def find_by_name(cls, name):
-        """Returns all Customers with the given name
+    def _cached(cls, by_id):
+        """Returns the Customer already in the session or in the cache, or None
+
+        The session's own copy is never overwritten with cached values. When
+        the two are of different versions one of them is stale, so the cache
+        entry is dropped and the session's copy is read again on first use.
+        """
+        values = customer_cache.get(by_id)
+        customer = db.session.identity_map.get(db.session.identity_key(cls, by_id))
+        if customer is not None:
+            version = inspect(customer).dict.get("version")
+            if values is not None and version is not None and values["version"] != version:
+                customer_cache.delete(by_id)
+                db.session.expire(customer)
+            return customer
+        if values is None:
+            return None
+        # attach the cached state to the session without a SELECT
+        customer = cls(**values)
+        make_transient_to_detached(customer)
+        return db.session.merge(customer, load=False)
+
+    @classmethod
+    def find_by_name(cls, name, fields=None, limit: int = None) -> list:
+        """Returns the Customers with the given name, ignoring case
 
         Args:
             name (string): the name of the Customers you want to match
+            fields (tuple): only load these fields, see parse_fields()
+            limit (int): return at most this many Customers, or every one when None
         """
         logger.info("Processing name query for %s ...", name)
-        return cls.query.filter(cls.name == name).all()
+        return cls._find({"name": name}, fields, limit)
 
     @classmethod
-    def find_by_address(cls, address):
-        """Returns all Customers with the given address
+    def find_by_address(cls, address, fields=None, limit: int = None) -> list:
+        """Returns the Customers with the given address
 
-        :param name: the address of the Customers you want to match
+        :param address: the address of the Customers you want to match
         :type address: str
+        :param fields: only load these fields, see parse_fields()
+        :type fields: tuple
+        :param limit: return at most this many Customers, or every one when None
+        :type limit: int
 
         :return: a collection of Customers with that address
         :rtype: list
 
         """
         logger.info("Processing address query for %s ...", address)
-        return cls.query.filter(cls.address == address)
+        return cls._find({"address": address}, fields, limit)
 
     @classmethod
-    def find_by_email(cls, email):
-        """Return the Customer with the given email
+    def find_by_email(cls, email, fields=None):
+        """Returns the Customer with the given email, or None
+
+        Emails are unique, so this is a single row lookup on their index.
 
         Args:
             email (string): the email of the Customer you want to match
+            fields (tuple): only load these fields, see parse_fields()
         """
         logger.info("Processing email query for %s ...", email)
-        return cls.query.filter(cls.email == email)
+        return cls._select(fields).filter(cls.email == email).first()
 
     @classmethod
-    def find_by_availability(cls, available: bool = True) -> list:
-        """Returns all Customers by their availability
+    def find_by_availability(cls, available: bool = True, fields=None, limit: int = None) -> list:
+        """Returns the Customers by their availability
 
         :param available: True for Customers that are available
-        :type available: str
+        :type available: bool
+        :param fields: only load these fields, see parse_fields()
+        :type fields: tuple
+        :param limit: return at most this many Customers, or every one when None
+        :type limit: int
 
         :return: a collection of Customers that are available
         :rtype: list
 
         """
         logger.info("Processing available query for %s ...", available)
-        return cls.query.filter(cls.available == available)
+        return cls._find({"available": available}, fields, limit)
 
     @classmethod
     def find_or_404(cls, customer_id: int):
@@ -183,11 +658,79 @@ class Customer(db.Model):
         return cls.query.get_or_404(customer_id)
 
     @classmethod
-    def find_by_phone(cls, phone):
-        """Returns all Customers with the given name
+    def find_by_phone(cls, phone, fields=None, limit: int = None) -> list:
+        """Returns the Customers with the given phone number
 
         Args:
-            name (string): the name of the Customers you want to match
+            phone (string): the phone number of the Customers you want to match
+            fields (tuple): only load these fields, see parse_fields()
+            limit (int): return at most this many Customers, or every one when None
         """
         logger.info("Processing phone number query for %s ...", phone)
-        return cls.query.filter(cls.phone_number == phone).all()
+        return cls._find({"phone_number": phone}, fields, limit)
+
+    @classmethod
+    def _find(cls, filters: dict, fields=None, limit: int = None) -> list:
+        """Returns the Customers that match the filters in id order, at most limit of them
+
+        Every match is returned when limit is None. Use paginate() to read a
+        large result a page at a time, or stream_by() to read it in batches.
+        """
+        query = cls.query_by(filters, fields=fields)
+        if limit is None:
+            return query.all()
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            raise DataValidationError(
+                f"Invalid limit: must be between 1 and {MAX_PAGE_SIZE}"
+            )
+        return query.limit(limit).all()
+
+    @classmethod
+    def stream_by(cls, filters=None, batch_size: int = 1000):
+        """Yields every Customer that matches the filters without loading them all at once
+
+        :param filters: column values the Customers must match, see query_by()
+        :type filters: dict
+        :param batch_size: the number of rows to fetch per round trip
+        :type batch_size: int
+
+        :return: a generator of Customers in id order
+        :rtype: generator
+
+        """
+        logger.info("Streaming Customers matching %s in batches of %d", filters, batch_size)
+        yield from cls.query_by(filters).yield_per(batch_size)
+
+
+def customer_stats() -> dict:
+    """Returns the number of Customers in total, available and suspended
+
+    The counts come from a single GROUP BY query and are cached for a few
+    seconds, so dashboards that refresh often cost next to nothing.
+
+    :return: the "total", "available" and "suspended" counts
+    :rtype: dict
+
+    """
+    counts = stats_cache.get("availability")
+    if counts is not None:
+        return counts
+    logger.info("Processing Customer stats")
+    rows = (
+        db.session.query(Customer.available, db.func.count(Customer.id))
+        .group_by(Customer.available)
+        .all()
+    )
+    by_availability = {bool(available): count for available, count in rows}
+    counts = {
+        "total": sum(by_availability.values()),
+        "available": by_availability.get(True, 0),
+        "suspended": by_availability.get(False, 0),
+    }
+    stats_cache.set("availability", counts)
+    return counts
+
+
+# The trigram index of search() needs the pg_trgm extension
+TRIGRAM_EXTENSION = DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+event.listen(Customer.__table__, "before_create", TRIGRAM_EXTENSION)
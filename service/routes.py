@@ -4,10 +4,20 @@ My Service
 Describe what your service does here
 """
 
-from flask import request, make_response, abort
+import hashlib
+import json
+from flask import jsonify, request, make_response, abort, Response, stream_with_context
 from flask_restx import Resource, fields, reqparse, inputs
+from werkzeug.http import quote_etag
+from service import bulk
 from service.common import status  # HTTP Status Codes
-from service.models import Customer
+from service.common.health import ReadinessCheck
+from service.common.json_provider import json_response
+from service.common.metrics import pool_stats, render_metrics
+from service.models import (
+    Customer, db, DEFAULT_PAGE_SIZE, DEFAULT_SEARCH_LIMIT, QUERY_FILTERS, QUERY_SORTS, DuplicateEmailError,
+    VersionConflictError, customer_cache, customer_serializer, customer_stats, parse_fields, serializer_for
+)
 from . import app, api
 
 ######################################################################
@@ -21,6 +31,61 @@ def index():
     return app.send_static_file("index.html")
 
 
+######################################################################
+# Health probes
+######################################################################
+
+readiness = ReadinessCheck()
+readiness.init_app(app)
+
+
+@app.route("/health")
+def health():
+    """Liveness probe, answers as long as the process serves requests"""
+    return jsonify(status="OK"), status.HTTP_200_OK
+
+
+@app.route("/ready")
+def ready():
+    """Readiness probe, answers 200 only while the database can be queried"""
+    is_ready, reason = readiness.check(db.engine.url)
+    if not is_ready:
+        return jsonify(status="Unavailable", database=reason), status.HTTP_503_SERVICE_UNAVAILABLE
+    return jsonify(status="OK", database="OK"), status.HTTP_200_OK
+
+
+@app.route("/cache/stats")
+def cache_stats():
+    """Returns the hit, miss and eviction counters of the Customer cache"""
+    return jsonify(customer_cache.stats()), status.HTTP_200_OK
+
+
+@app.route("/pool/stats")
+def db_pool_stats():
+    """Returns the connections checked out of the database pool and the wait times"""
+    return jsonify(pool_stats(db.engine)), status.HTTP_200_OK
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Returns the request and database metrics in Prometheus text format"""
+    body, content_type = render_metrics()
+    return Response(body, status=status.HTTP_200_OK, content_type=content_type)
+
+
+@app.before_request
+def route_writes_to_primary():
+    """Keeps requests that change data on the primary for all of their queries
+
+    The session outlives each request, so every request starts back on the
+    replicas rather than staying pinned by an earlier write.
+    """
+    session = db.session()
+    session.use_replicas()
+    if request.method not in ("GET", "HEAD", "OPTIONS"):
+        session.use_primary()
+
+
 # Define the model so that the docs reflect what can be sent
 create_model = api.model(
     "Customer",
@@ -93,6 +158,146 @@ customer_args.add_argument(
     required=False,
     help="List Pets by available",
 )
+customer_args.add_argument(
+    "email",
+    type=str,
+    location="args",
+    required=False,
+    help="List Customers by email",
+)
+customer_args.add_argument(
+    "address",
+    type=str,
+    location="args",
+    required=False,
+    help="List Customers by address",
+)
+customer_args.add_argument(
+    "sort",
+    type=str,
+    location="args",
+    required=False,
+    choices=QUERY_SORTS,
+    help="Sort Customers by this field",
+)
+customer_args.add_argument(
+    "order",
+    type=str,
+    location="args",
+    required=False,
+    choices=("asc", "desc"),
+    default="asc",
+    help="Sort Customers in ascending or descending order",
+)
+customer_args.add_argument(
+    "limit",
+    type=int,
+    location="args",
+    required=False,
+    help="Page through Customers this many at a time",
+)
+customer_args.add_argument(
+    "cursor",
+    type=str,
+    location="args",
+    required=False,
+    help="Opaque cursor from the X-Next-Cursor header of the previous page",
+)
+customer_args.add_argument(
+    "fields",
+    type=str,
+    location="args",
+    required=False,
+    help="Comma separated fields to return, such as name,available",
+)
+customer_args.add_argument(
+    "count_only",
+    type=inputs.boolean,
+    location="args",
+    required=False,
+    default=False,
+    help="Return only the number of matching Customers",
+)
+
+# query string arguments for a single customer
+fields_args = reqparse.RequestParser()
+fields_args.add_argument(
+    "fields",
+    type=str,
+    location="args",
+    required=False,
+    help="Comma separated fields to return, such as name,available",
+)
+
+# Define the counts returned by the stats endpoint
+stats_model = api.model(
+    "CustomerStats",
+    {
+        "total": fields.Integer(description="Number of Customers"),
+        "available": fields.Integer(description="Number of available Customers"),
+        "suspended": fields.Integer(description="Number of suspended Customers"),
+    },
+)
+
+# query string arguments for a search
+search_args = reqparse.RequestParser()
+search_args.add_argument(
+    "q",
+    type=str,
+    location="args",
+    required=True,
+    help="Words to look for in the name, email and address of Customers",
+)
+search_args.add_argument(
+    "limit",
+    type=int,
+    location="args",
+    required=False,
+    default=DEFAULT_SEARCH_LIMIT,
+    help="Return at most this many Customers",
+)
+search_args.add_argument(
+    "fields",
+    type=str,
+    location="args",
+    required=False,
+    help="Comma separated fields to return, such as name,available",
+)
+
+# Define the selection accepted by the bulk endpoints
+bulk_filter_model = api.model(
+    "BulkFilter",
+    {
+        "name": fields.String(description="Only Customers with this name"),
+        "phone_number": fields.String(description="Only Customers with this phone_number"),
+        "available": fields.Boolean(description="Only Customers with this availability"),
+    },
+)
+
+bulk_selection_model = api.model(
+    "BulkSelection",
+    {
+        "ids": fields.List(fields.Integer, description="The ids of the Customers to change"),
+        "filter": fields.Nested(bulk_filter_model, description="Change the Customers matching this filter"),
+        "returning": fields.Boolean(description="Return the ids that were changed"),
+    },
+)
+
+bulk_delete_model = api.inherit(
+    "BulkDelete",
+    bulk_selection_model,
+    {
+        "dry_run": fields.Boolean(description="Only count the Customers that would be deleted"),
+    },
+)
+
+bulk_update_model = api.inherit(
+    "BulkUpdate",
+    bulk_selection_model,
+    {
+        "values": fields.Raw(required=True, description="The column values to write"),
+    },
+)
 
 
 ######################################################################
@@ -114,23 +319,34 @@ class CustomerResource(Resource):
     # RETRIEVE A CUSTOMER
     # ------------------------------------------------------------------
     @api.doc("get_customers")
+    @api.expect(fields_args, validate=True)
+    @api.response(304, "Customer not modified since the ETag in If-None-Match")
+    @api.response(400, "The fields were not valid")
     @api.response(404, "Customer not found")
-    @api.marshal_with(customer_model)
+    @api.response(200, "Success", customer_model)
     def get(self, customer_id):
         """
         Retrieve a single Customer
         This endpoint will return a Customer based on it's id
         """
         app.logger.info("Request for customer with id: %s", customer_id)
-        customer = Customer.find(customer_id)
+        args = fields_args.parse_args()
+        field_names = parse_fields(args["fields"]) if args["fields"] else None
+        customer = Customer.find(customer_id, fields=field_names)
         if not customer:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Customer with id '{customer_id}' was not found.",
             )
 
-        app.logger.info("Returning customer: %s", customer.name)
-        return customer.serialize(), status.HTTP_200_OK
+        etag = customer.etag if field_names is None else compute_etag([customer.etag, field_names])
+        headers = {"ETag": quote_etag(etag)}
+        if request.if_none_match.contains_weak(etag):
+            app.logger.info("Customer %s not modified", customer_id)
+            return json_response(b"", status.HTTP_304_NOT_MODIFIED, headers)
+        app.logger.info("Returning customer with id: %s", customer_id)
+        serializer = serializer_for(field_names) if field_names else customer_serializer
+        return json_response(serializer.one(customer), status.HTTP_200_OK, headers)
 
     # ------------------------------------------------------------------
     # MODIFY A CUSTOMER
@@ -138,8 +354,10 @@ class CustomerResource(Resource):
     @api.doc("update_customers")
     @api.response(404, "Customer not found")
     @api.response(400, "The posted customer data was not valid")
+    @api.response(409, "Another customer has the same email")
+    @api.response(412, "The customer was changed since the ETag in If-Match")
     @api.expect(customer_model)
-    @api.marshal_with(customer_model)
+    @api.response(200, "Success", customer_model)
     def put(self, customer_id):
         """
         Update a customer
@@ -148,34 +366,63 @@ class CustomerResource(Resource):
         app.logger.info("Request to update customer with id: %s", customer_id)
         check_content_type("application/json")
 
-        customer = Customer.find(customer_id)
-        if not customer:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Customer with id '{customer_id}' was not found.",
-            )
-        data = api.payload
-        customer.deserialize(data)
-        customer.id = customer_id
-        customer.update()
+        # the stored row is read rather than a cached copy, which another
+        # worker may have made stale, and If-Match is checked against it
+        if_match = "If-Match" in request.headers
+        customer = Customer.find(customer_id, fresh=True)
+        for attempt in range(2):
+            if not customer:
+                abort(
+                    status.HTTP_404_NOT_FOUND,
+                    f"Customer with id '{customer_id}' was not found.",
+                )
+            if if_match and not request.if_match.contains(customer.etag):
+                app.logger.warning("Customer %s does not match If-Match", customer_id)
+                abort(
+                    status.HTTP_412_PRECONDITION_FAILED,
+                    f"Customer with id '{customer_id}' does not match If-Match.",
+                )
+            customer.deserialize(api.payload)
+            customer.id = customer_id
+            try:
+                customer.update()
+                break
+            except VersionConflictError as error:
+                if if_match or attempt:
+                    abort(status.HTTP_412_PRECONDITION_FAILED, str(error))
+                # changed since it was read, so update the stored Customer instead
+                customer = Customer.find(customer_id, fresh=True)
+            except DuplicateEmailError as error:
+                abort(status.HTTP_409_CONFLICT, str(error))
         app.logger.info("Customer with ID [%s] updated.", customer.id)
-        return customer.serialize(), status.HTTP_200_OK
+        return json_response(
+            customer_serializer.one(customer), status.HTTP_200_OK, {"ETag": quote_etag(customer.etag)}
+        )
 
     # ------------------------------------------------------------------
     # DELETE A CUSTOMER
     # ------------------------------------------------------------------
     @api.doc("delete_customers")
     @api.response(204, "Customer deleted")
+    @api.response(412, "The customer kept changing while it was deleted")
     def delete(self, customer_id):
         """
         Delete a customer
         This endpoint will delete a customer based the id in the path
         """
-        customer = Customer()
         app.logger.info("Request to delete a customer with id: %s", customer_id)
-        customer = customer.find(customer_id)
+        customer = Customer.find(customer_id)
         if customer:
-            customer.delete()
+            try:
+                customer.delete()
+            except VersionConflictError:
+                # the cached copy was stale, so delete the stored Customer instead
+                customer = Customer.find(customer_id, fresh=True)
+                if customer:
+                    try:
+                        customer.delete()
+                    except VersionConflictError as error:
+                        abort(status.HTTP_412_PRECONDITION_FAILED, str(error))
         return make_response("", status.HTTP_204_NO_CONTENT)
 
 
@@ -191,35 +438,37 @@ class CustomerCollection(Resource):
     # ------------------------------------------------------------------
     @api.doc("list_customers")
     @api.expect(customer_args, validate=True)
-    @api.marshal_list_with(customer_model)
+    @api.response(304, "Customers not modified since the ETag in If-None-Match")
+    @api.response(400, "The limit, cursor or fields were not valid")
+    @api.response(200, "Success", [customer_model])
     def get(self):
         """Returns all of the Customers"""
         app.logger.info("Request for customer list")
-        customers = []
         args = customer_args.parse_args()
-        if args["id"]:
-            customer = Customer.find(args["id"])
-            customers = [customer] if customer else []
-        elif args["phone_number"]:
-            customers = Customer.find_by_phone(args["phone_number"])
-        elif args["name"]:
-            customers = Customer.find_by_name(args["name"])
-        elif args["available"]:
-            customers = Customer.find_by_availability(args["available"])
-        else:
-            customers = Customer.all()
-
-        results = [customer.serialize() for customer in customers]
-        app.logger.info("Returning %d customers", len(results))
-        return results, status.HTTP_200_OK
+        if args["count_only"]:
+            filters = list_filters(args)
+            return {"count": Customer.count(filters)}, status.HTTP_200_OK
+        field_names = parse_fields(args["fields"]) if args["fields"] else None
+        customers, headers = find_customers(args, field_names)
+
+        customers = list(customers)
+        etag = compute_etag([customer.etag for customer in customers] + [field_names])
+        headers["ETag"] = quote_etag(etag)
+        if request.if_none_match.contains_weak(etag):
+            app.logger.info("Customer list not modified")
+            return json_response(b"", status.HTTP_304_NOT_MODIFIED, headers)
+        app.logger.info("Returning %d customers", len(customers))
+        serializer = serializer_for(field_names) if field_names else customer_serializer
+        return json_response(serializer.many(customers), status.HTTP_200_OK, headers)
     # ------------------------------------------------------------------
     # ADD A NEW CUSTOMER
     # ------------------------------------------------------------------
 
     @api.doc("create_customers")
     @api.response(400, "The posted data was not valid")
+    @api.response(409, "A customer with that email already exists")
     @api.expect(create_model)
-    @api.marshal_with(customer_model, code=201)
+    @api.response(201, "Customer created", customer_model)
     def post(self):
         """
         Creates a customer
@@ -229,11 +478,274 @@ class CustomerCollection(Resource):
         check_content_type("application/json")
         customer = Customer()
         customer.deserialize(api.payload)
-        customer.create()
+        try:
+            customer.create()
+        except DuplicateEmailError as error:
+            abort(status.HTTP_409_CONFLICT, str(error))
         location_url = api.url_for(CustomerResource, customer_id=customer.id, _external=True)
         app.logger.info("Customer with ID [%s] created.", customer.id)
         print("Customer with ID ", customer.id, " created.")
-        return customer.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
+        return json_response(
+            customer_serializer.one(customer),
+            status.HTTP_201_CREATED,
+            {"Location": location_url, "ETag": quote_etag(customer.etag)},
+        )
+
+
+######################################################################
+#  PATH: /customers/bulk
+######################################################################
+@api.route("/customers/bulk")
+class BulkResource(Resource):
+    """Handles batches of Customers in a single request"""
+
+    @api.doc("bulk_create_customers")
+    @api.response(400, "The posted data was not a list of customers")
+    @api.response(415, "The Content-Type was not JSON or NDJSON")
+    @api.expect([create_model])
+    def post(self):
+        """
+        Creates many customers
+        This endpoint accepts a JSON array, or newline-delimited JSON, of customers
+        and reports which rows were created and which were rejected
+        """
+        app.logger.info("Request to bulk create customers")
+        content_type = request.headers.get("Content-Type")
+        if content_type == "application/x-ndjson":
+            rows = []
+            for line in request.get_data(as_text=True).splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    rows.append(None)  # reported as a bad row by bulk_create
+        else:
+            check_content_type("application/json")
+            rows = api.payload
+            if not isinstance(rows, list):
+                abort(status.HTTP_400_BAD_REQUEST, "Request body must be a JSON array")
+
+        created, errors = bulk.bulk_create(rows, app.config["BULK_CHUNK_SIZE"])
+        app.logger.info("Bulk created %d customers, %d rejected", len(created), len(errors))
+        return {"created": created, "errors": errors}, status.HTTP_200_OK
+
+    @api.doc("bulk_update_customers")
+    @api.response(400, "The selection or values were not valid")
+    @api.response(409, "The email belongs to another customer")
+    @api.expect(bulk_update_model)
+    def patch(self):
+        """
+        Updates many customers
+        This endpoint will write the same values to every customer selected by ids or a filter
+        """
+        app.logger.info("Request to bulk update customers")
+        check_content_type("application/json")
+        ids, filters, returning = parse_bulk_selection(api.payload)
+        try:
+            count, changed_ids = bulk.bulk_update(
+                api.payload.get("values"),
+                ids=ids,
+                filters=filters,
+                returning=returning,
+                chunk_size=app.config["BULK_CHUNK_SIZE"],
+            )
+        except DuplicateEmailError as error:
+            abort(status.HTTP_409_CONFLICT, str(error))
+        app.logger.info("Bulk update changed %d customers", count)
+        return bulk_result(count, changed_ids), status.HTTP_200_OK
+
+    @api.doc("bulk_delete_customers")
+    @api.response(400, "The selection was not valid")
+    @api.expect(bulk_delete_model)
+    def delete(self):
+        """
+        Deletes many customers
+        This endpoint will delete every customer selected by ids or a filter,
+        or only count them when dry_run is true
+        """
+        app.logger.info("Request to bulk delete customers")
+        check_content_type("application/json")
+        ids, filters, _ = parse_bulk_selection(api.payload)
+        dry_run = bool(api.payload.get("dry_run"))
+        count = bulk.bulk_delete(
+            ids=ids,
+            filters=filters,
+            dry_run=dry_run,
+            chunk_size=app.config["BULK_CHUNK_SIZE"],
+        )
+        app.logger.info("Bulk delete matched %d customers (dry run: %s)", count, dry_run)
+        return {"count": count, "dry_run": dry_run}, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /customers/bulk/{action}
+######################################################################
+@api.route("/customers/bulk/<string:action>")
+@api.param("action", "Either suspend or activate")
+class BulkAvailabilityResource(Resource):
+    """Suspend or activate many customers at once"""
+
+    @api.doc("bulk_set_availability")
+    @api.response(400, "The selection was not valid")
+    @api.response(404, "The action is not suspend or activate")
+    @api.expect(bulk_selection_model)
+    def put(self, action):
+        """
+        Suspend or activate many customers
+        This endpoint will suspend or activate every customer selected by ids or a filter
+        """
+        if action not in ("suspend", "activate"):
+            abort(status.HTTP_404_NOT_FOUND, f"Unknown bulk action '{action}'.")
+        app.logger.info("Request to bulk %s customers", action)
+        check_content_type("application/json")
+        ids, filters, returning = parse_bulk_selection(api.payload)
+        count, changed_ids = bulk.bulk_update(
+            {"available": action == "activate"},
+            ids=ids,
+            filters=filters,
+            returning=returning,
+            chunk_size=app.config["BULK_CHUNK_SIZE"],
+        )
+        app.logger.info("Bulk %s changed %d customers", action, count)
+        return bulk_result(count, changed_ids), status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /customers/by-email/{email}
+######################################################################
+@api.route("/customers/by-email/<string:email>")
+@api.param("email", "The Customer email")
+class UpsertResource(Resource):
+    """Creates or replaces a customer identified by email"""
+
+    @api.doc("upsert_customer")
+    @api.response(400, "The posted customer data was not valid")
+    @api.expect(create_model)
+    @api.response(201, "Customer created", customer_model)
+    @api.response(200, "Customer updated", customer_model)
+    def put(self, email):
+        """
+        Create or update a Customer by email
+        This endpoint writes the customer in a single statement, creating it when
+        no customer has the email and updating it otherwise
+        """
+        app.logger.info("Request to upsert customer with email %s", email)
+        check_content_type("application/json")
+        data = api.payload
+        if not isinstance(data, dict):
+            abort(status.HTTP_400_BAD_REQUEST, "Request body must be a JSON object")
+        customer, created = bulk.upsert(dict(data, email=email))
+        app.logger.info("Customer with ID [%s] %s.", customer.id, "created" if created else "updated")
+        headers = {"ETag": quote_etag(customer.etag)}
+        if created:
+            headers["Location"] = api.url_for(CustomerResource, customer_id=customer.id, _external=True)
+        return json_response(
+            customer_serializer.one(customer),
+            status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+            headers,
+        )
+
+
+######################################################################
+#  PATH: /customers/by-email
+######################################################################
+@api.route("/customers/by-email")
+class BulkUpsertResource(Resource):
+    """Creates or replaces many customers identified by email"""
+
+    @api.doc("bulk_upsert_customers")
+    @api.response(400, "The request body was not a JSON array")
+    @api.expect([create_model])
+    def put(self):
+        """
+        Create or update many Customers by email
+        This endpoint accepts a JSON array of customers and reports which rows were
+        created, which updated and which rejected
+        """
+        app.logger.info("Request to bulk upsert customers")
+        check_content_type("application/json")
+        rows = api.payload
+        if not isinstance(rows, list):
+            abort(status.HTTP_400_BAD_REQUEST, "Request body must be a JSON array")
+        created, updated, errors = bulk.bulk_upsert(rows, app.config["BULK_CHUNK_SIZE"])
+        app.logger.info(
+            "Bulk upsert created %d, updated %d and rejected %d customers", len(created), len(updated), len(errors)
+        )
+        return {"created": created, "updated": updated, "errors": errors}, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /customers/export
+######################################################################
+@api.route("/customers/export")
+class ExportResource(Resource):
+    """Streams the whole Customer table"""
+
+    @api.doc("export_customers")
+    @api.produces(["application/x-ndjson"])
+    def get(self):
+        """
+        Export all Customers
+        This endpoint streams every Customer as newline-delimited JSON
+        """
+        app.logger.info("Request to export all Customers")
+        batch_size = app.config["EXPORT_BATCH_SIZE"]
+
+        def generate():
+            for customer in Customer.stream_by(batch_size=batch_size):
+                yield customer_serializer.one(customer) + b"\n"
+
+        return Response(
+            stream_with_context(generate()),
+            status=status.HTTP_200_OK,
+            mimetype="application/x-ndjson",
+        )
+
+
+######################################################################
+#  PATH: /customers/stats
+######################################################################
+@api.route("/customers/stats")
+class StatsResource(Resource):
+    """Counts of Customers computed by the database"""
+
+    @api.doc("customer_stats")
+    @api.response(200, "Success", stats_model)
+    def get(self):
+        """
+        Count Customers
+        This endpoint returns how many customers there are in total, available and suspended
+        """
+        app.logger.info("Request for customer stats")
+        return customer_stats(), status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /customers/search
+######################################################################
+@api.route("/customers/search")
+class SearchResource(Resource):
+    """Finds Customers by parts of their name, email or address"""
+
+    @api.doc("search_customers")
+    @api.expect(search_args, validate=True)
+    @api.response(400, "The query, limit or fields were not valid")
+    @api.response(200, "Success", [customer_model])
+    def get(self):
+        """
+        Search Customers
+        This endpoint returns the Customers whose name, email or address contain
+        every word of q, best matches first
+        """
+        args = search_args.parse_args()
+        app.logger.info("Request to search customers for %s", args["q"])
+        field_names = parse_fields(args["fields"]) if args["fields"] else None
+        projection = {"fields": field_names} if field_names else {}
+        customers = Customer.search(args["q"], args["limit"], **projection)
+        app.logger.info("Returning %d customers", len(customers))
+        serializer = serializer_for(field_names) if field_names else customer_serializer
+        return json_response(serializer.many(customers), status.HTTP_200_OK)
 
 
 ######################################################################
@@ -254,7 +766,7 @@ class SuspendResource(Resource):
         """
         app.logger.info("Request to suspend Customer with id: %s", customer_id)
 
-        customer = Customer.find(customer_id)
+        customer = bulk.set_availability(customer_id, False)
         if not customer:
             # if no customer is found, return a 404
             app.logger.error("Customer with id %s does not exist", customer_id)
@@ -262,10 +774,10 @@ class SuspendResource(Resource):
                 status.HTTP_404_NOT_FOUND, f"Customer with id {customer_id} does not exist"
             )
 
-        customer.available = False
-        customer.update()
         app.logger.error("Customer with id %s suspend complete.", customer_id)
-        return customer.serialize(), status.HTTP_200_OK
+        return json_response(
+            customer_serializer.one(customer), status.HTTP_200_OK, {"ETag": quote_etag(customer.etag)}
+        )
 
 
 ######################################################################
@@ -287,7 +799,7 @@ class ActivateResource(Resource):
         """
         app.logger.info("Request to activate Customer with id: %s", customer_id)
 
-        customer = Customer.find(customer_id)
+        customer = bulk.set_availability(customer_id, True)
         if not customer:
             # if no customer is found, return a 404
             app.logger.error("Customer with id %s does not exist", customer_id)
@@ -295,15 +807,91 @@ class ActivateResource(Resource):
                 status.HTTP_404_NOT_FOUND, f"Customer with id {customer_id} does not exist"
             )
 
-        customer.available = True
-        customer.update()
         app.logger.error("Customer with id %s activated complete.", customer_id)
-        return customer.serialize(), status.HTTP_200_OK
+        return json_response(
+            customer_serializer.one(customer), status.HTTP_200_OK, {"ETag": quote_etag(customer.etag)}
+        )
 
 
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
+def list_filters(args) -> dict:
+    """Returns the filters given in the list query arguments by column name"""
+    return {name: args[name] for name in QUERY_FILTERS if args[name] not in (None, "")}
+
+
+def find_customers(args, field_names=None):
+    """
+    Returns the Customers selected by the list query arguments, loading only
+    the given fields, and the headers that link to the next page
+
+    Every filter given is combined into a single query, except a lookup by id
+    alone, which reads through the cache.
+    """
+    headers = {}
+    projection = {"fields": field_names} if field_names else {}
+    filters = list_filters(args)
+    if list(filters) == ["id"]:
+        customer = Customer.find(args["id"], **projection)
+        customers = [customer] if customer else []
+    elif args["limit"] is not None or args["cursor"]:
+        if args["sort"] not in (None, "id") or args["order"] != "asc":
+            abort(status.HTTP_400_BAD_REQUEST, "Pages are always sorted by id in ascending order")
+        limit = DEFAULT_PAGE_SIZE if args["limit"] is None else args["limit"]
+        customers, next_cursor = Customer.paginate(limit, args["cursor"], filters=filters, **projection)
+        if next_cursor:
+            headers = next_page_headers(args, filters, limit, next_cursor)
+    else:
+        customers = Customer.query_by(filters, args["sort"], args["order"], **projection).all()
+    return customers, headers
+
+
+def next_page_headers(args, filters, limit, next_cursor):
+    """
+    Returns the headers that link to the page after next_cursor
+    """
+    query = dict(filters, limit=limit, cursor=next_cursor)
+    if args["fields"]:
+        query["fields"] = args["fields"]
+    next_url = api.url_for(CustomerCollection, _external=True, **query)
+    return {"X-Next-Cursor": next_cursor, "Link": f'<{next_url}>; rel="next"'}
+
+
+def compute_etag(data):
+    """
+    Returns a strong ETag for a JSON serializable value
+    """
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def parse_bulk_selection(payload):
+    """
+    Returns the ids, filter and returning flag of a bulk request body
+    """
+    if not isinstance(payload, dict):
+        abort(status.HTTP_400_BAD_REQUEST, "Request body must be a JSON object")
+    ids = payload.get("ids")
+    if ids is not None and (
+        not isinstance(ids, list) or not all(isinstance(id_, int) for id_ in ids)
+    ):
+        abort(status.HTTP_400_BAD_REQUEST, "ids must be a list of integers")
+    filters = payload.get("filter")
+    if filters is not None and not isinstance(filters, dict):
+        abort(status.HTTP_400_BAD_REQUEST, "filter must be a JSON object")
+    return ids, filters, bool(payload.get("returning"))
+
+
+def bulk_result(count, ids):
+    """
+    Builds the response body of a bulk request
+    """
+    result = {"count": count}
+    if ids is not None:
+        result["ids"] = ids
+    return result
+
+
 def check_content_type(content_type):
     """
     Checks that the media type is correct
@@ -32,7 +32,7 @@ class CustomerFactory(factory.Factory):
     id = factory.Sequence(lambda n: n)
     name = factory.Faker("name")
     address = factory.Faker("address")
-    email = factory.Faker("email")
+    email = factory.Sequence(lambda n: f"customer{n}@example.com")
     password = factory.Faker("password")
     phone_number = factory.Faker("phone_number")
     available = FuzzyChoice(choices=[True, False])
@@ -0,0 +1,200 @@
+"""
+Test cases for the Cache module
+"""
+import socket
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+import redis
+from flask import Flask
+from fakeredis import TcpFakeServer
+from service.common.cache import Cache, LRUCache, RedisCache
+
+
+def wait_for(condition, timeout=2.0):
+    """Polls condition until it is true or timeout seconds have passed"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestLRUCache(TestCase):
+    """Test Cases for LRUCache"""
+
+    def test_get_and_set(self):
+        """It should return what was cached and count hits and misses"""
+        cache = LRUCache(maxsize=2, ttl=60)
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 1)
+
+    def test_evicts_least_recently_used(self):
+        """It should evict the least recently used entry when full"""
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.evictions, 1)
+
+    @patch("service.common.cache.time.monotonic")
+    def test_entries_expire(self, mock_monotonic):
+        """It should not return an entry older than its ttl"""
+        mock_monotonic.return_value = 100.0
+        cache = LRUCache(maxsize=2, ttl=10)
+        cache.set("a", 1)
+        mock_monotonic.return_value = 111.0
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_delete_and_clear(self):
+        """It should remove single entries and all entries"""
+        cache = LRUCache(maxsize=5, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.delete("a")
+        cache.delete("missing")
+        self.assertIsNone(cache.get("a"))
+        cache.clear()
+        self.assertIsNone(cache.get("b"))
+
+    def test_disabled_cache(self):
+        """It should not store anything when maxsize is 0"""
+        cache = LRUCache(maxsize=0, ttl=60)
+        cache.set("a", 1)
+        self.assertEqual(cache.stats()["size"], 0)
+
+
+class TestRedisCache(TestCase):
+    """Test Cases for RedisCache against a local fake Redis server"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        host, port = cls.server.server_address
+        cls.url = f"redis://{host}:{port}/0"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        # two caches stand in for two gunicorn workers
+        self.worker_a = RedisCache(self.url, maxsize=10, ttl=60)
+        self.worker_b = RedisCache(self.url, maxsize=10, ttl=60)
+        self.assertTrue(wait_for(lambda: self.worker_a.pubsub.subscribed and self.worker_b.pubsub.subscribed))
+        self.worker_a.clear()
+
+    def tearDown(self):
+        self.worker_a.close()
+        self.worker_b.close()
+
+    def test_shared_between_workers(self):
+        """It should serve a value cached by one worker to another"""
+        self.worker_a.set(1, {"id": 1, "name": "shared"})
+        self.assertEqual(self.worker_b.get(1), {"id": 1, "name": "shared"})
+        self.assertEqual(self.worker_b.stats()["backend"], "redis")
+        self.assertIsNone(self.worker_b.get(2))
+
+    def test_delete_invalidates_every_worker(self):
+        """It should drop the local copy of every worker on delete"""
+        self.worker_a.set(1, {"id": 1})
+        self.assertEqual(self.worker_b.get(1), {"id": 1})
+        self.worker_a.delete(1)
+        self.assertTrue(wait_for(lambda: self.worker_b.local.stats()["size"] == 0))
+        self.assertIsNone(self.worker_b.get(1))
+
+    def test_clear_invalidates_every_worker(self):
+        """It should drop every local copy of every worker on clear"""
+        self.worker_a.set(1, {"id": 1})
+        self.worker_a.set(2, {"id": 2})
+        self.worker_b.get(1)
+        self.worker_b.get(2)
+        self.worker_a.clear()
+        self.assertTrue(wait_for(lambda: self.worker_b.local.stats()["size"] == 0))
+        self.assertIsNone(self.worker_b.get(1))
+
+    def test_server_unavailable(self):
+        """It should degrade to the local cache when the server is down"""
+        with patch.object(self.worker_b.client, "get", side_effect=redis.ConnectionError("down")):
+            self.assertIsNone(self.worker_b.get(99))
+        with patch.object(self.worker_b.client, "set", side_effect=redis.ConnectionError("down")):
+            self.worker_b.set(99, {"id": 99})
+        self.assertEqual(self.worker_b.get(99), {"id": 99})
+        with patch.object(self.worker_b.client, "delete", side_effect=redis.ConnectionError("down")):
+            self.worker_b.delete(99)
+        with patch.object(self.worker_b.client, "scan_iter", side_effect=redis.ConnectionError("down")):
+            self.worker_b.clear()
+        self.assertIsNone(self.worker_b.local.get(99))
+
+    def test_lost_invalidation_channel(self):
+        """It should drop every local copy when the invalidation channel fails"""
+        self.worker_b.local.set(1, {"id": 1})
+        self.worker_b._on_listener_error(redis.ConnectionError("down"))  # pylint: disable=protected-access
+        self.assertIsNone(self.worker_b.local.get(1))
+
+    def test_server_down_at_start(self):
+        """It should start with the local cache when the server cannot be reached"""
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]  # nothing listens on it once closed
+        with patch("service.common.cache.RESUBSCRIBE_AFTER", 0.01):
+            cache = RedisCache(f"redis://127.0.0.1:{port}/0", maxsize=10, ttl=60, socket_connect_timeout=0.1)
+        self.assertEqual(cache.client.connection_pool.connection_kwargs["socket_connect_timeout"], 0.1)
+        try:
+            cache.set(1, {"id": 1})
+            self.assertEqual(cache.get(1), {"id": 1})
+            cache.delete(1)
+            self.assertIsNone(cache.get(1))
+            self.assertFalse(cache.pubsub.subscribed)
+            self.assertTrue(cache.listening)
+        finally:
+            cache.close()
+        self.assertFalse(cache.listening)
+
+
+class TestCache(TestCase):
+    """Test Cases for selecting a Cache backend from the config"""
+
+    def test_local_backend(self):
+        """It should use a local LRUCache by default"""
+        app = Flask(__name__)
+        app.config.update(CACHE_MAX_ENTRIES=10, CACHE_TTL=5)
+        cache = Cache()
+        cache.init_app(app)
+        self.assertIsInstance(cache.backend, LRUCache)
+        cache.set(1, "one")
+        self.assertEqual(cache.get(1), "one")
+        cache.delete(1)
+        self.assertIsNone(cache.get(1))
+        cache.set(2, "two")
+        cache.clear()
+        self.assertEqual(cache.stats()["size"], 0)
+
+    @patch("service.common.cache.RedisCache")
+    def test_redis_backend(self, mock_redis_cache):
+        """It should use a RedisCache when CACHE_BACKEND is redis"""
+        app = Flask(__name__)
+        app.config.update(
+            CACHE_BACKEND="redis", CACHE_REDIS_URL="redis://cache:6379/0", CACHE_MAX_ENTRIES=10, CACHE_TTL=5,
+            CACHE_REDIS_TIMEOUT=0.25,
+        )
+        cache = Cache()
+        cache.init_app(app)
+        mock_redis_cache.assert_called_once_with(
+            "redis://cache:6379/0", 10, 5, socket_timeout=0.25, socket_connect_timeout=0.25
+        )
+        self.assertIs(cache.backend, mock_redis_cache.return_value)
@@ -5,7 +5,9 @@ import os
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
-from service.common.cli_commands import db_create
+from sqlalchemy import inspect, text
+from service.common.cli_commands import db_create, db_index, db_upgrade
+from service.models import db, Customer
 
 
 class TestFlaskCLI(TestCase):
@@ -21,3 +23,106 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @staticmethod
+    def _connection(db_mock, valid):
+        """Returns the mocked db-index connection, reporting the email index validity in turn"""
+        db_mock.engine.dialect.name = "postgresql"
+        connection = db_mock.engine.connect.return_value.execution_options.return_value.__enter__.return_value
+        connection.execute.return_value.scalars.return_value.all.return_value = []
+        connection.execute.return_value.scalar.side_effect = valid
+        return connection
+
+    @staticmethod
+    def _statements(connection):
+        """Returns the SQL of the text statements executed on a mocked connection"""
+        return [str(call.args[0]) for call in connection.execute.call_args_list]
+
+    @patch('service.common.cli_commands.db')
+    def test_db_index(self, db_mock):
+        """It should call the db-index command"""
+        connection = self._connection(db_mock, [True, True])
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(db_index)
+            self.assertEqual(result.exit_code, 0)
+        db_mock.engine.connect.return_value.execution_options.assert_called_once_with(
+            isolation_level="AUTOCOMMIT"
+        )
+        statements = self._statements(connection)
+        self.assertNotIn("DROP INDEX CONCURRENTLY IF EXISTS ix_customer_email_unique", statements)
+        self.assertEqual(statements[-1], "DROP INDEX CONCURRENTLY IF EXISTS ix_customer_email")
+
+    @patch('service.common.cli_commands.db')
+    def test_db_index_rebuilds_invalid_index(self, db_mock):
+        """It should drop an invalid unique email index before building it again"""
+        connection = self._connection(db_mock, [False, True])
+        result = self.runner.invoke(db_index)
+        self.assertEqual(result.exit_code, 0, result.output)
+        statements = self._statements(connection)
+        self.assertIn("DROP INDEX CONCURRENTLY IF EXISTS ix_customer_email_unique", statements)
+        self.assertEqual(statements[-1], "DROP INDEX CONCURRENTLY IF EXISTS ix_customer_email")
+
+    @patch('service.common.cli_commands.db')
+    def test_db_index_keeps_retired_index(self, db_mock):
+        """It should keep the retired index while the unique email index is not valid"""
+        connection = self._connection(db_mock, [None, False])
+        result = self.runner.invoke(db_index)
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("not valid", result.output)
+        self.assertNotIn("DROP INDEX CONCURRENTLY IF EXISTS ix_customer_email", self._statements(connection))
+
+    def test_db_index_replaces_retired_index(self):
+        """It should build the unique email index and drop the one it replaces"""
+        with db.engine.begin() as connection:
+            connection.execute(text("DROP INDEX IF EXISTS ix_customer_email_unique"))
+            connection.execute(text("CREATE INDEX IF NOT EXISTS ix_customer_email ON customer (email)"))
+        result = self.runner.invoke(db_index)
+        self.assertEqual(result.exit_code, 0, result.output)
+        indexes = {ix["name"]: ix for ix in inspect(db.engine).get_indexes("customer")}
+        self.assertNotIn("ix_customer_email", indexes)
+        self.assertTrue(indexes["ix_customer_email_unique"]["unique"])
+
+    def test_db_index_duplicate_emails(self):
+        """It should not build the unique email index while emails are duplicated"""
+        with db.engine.begin() as connection:
+            connection.execute(text("DROP INDEX IF EXISTS ix_customer_email_unique"))
+            connection.execute(text("CREATE INDEX IF NOT EXISTS ix_customer_email ON customer (email)"))
+            for _ in range(2):
+                connection.execute(text(
+                    "INSERT INTO customer (name, address, email, password, available, version) "
+                    "VALUES ('twin', 'here', 'twin@example.com', 'secret', TRUE, 1)"
+                ))
+        try:
+            result = self.runner.invoke(db_index)
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn("twin@example.com", result.output)
+            indexes = {ix["name"] for ix in inspect(db.engine).get_indexes("customer")}
+            self.assertIn("ix_customer_email", indexes)
+            self.assertNotIn("ix_customer_email_unique", indexes)
+        finally:
+            with db.engine.begin() as connection:
+                connection.execute(text("DELETE FROM customer WHERE email = 'twin@example.com'"))
+        self.assertEqual(self.runner.invoke(db_index).exit_code, 0)
+
+    def test_db_upgrade_adds_version(self):
+        """It should add the version column to a table created without it"""
+        db.session.remove()
+        with db.engine.begin() as connection:
+            connection.execute(text("DROP TABLE customer"))
+            connection.execute(text(
+                "CREATE TABLE customer (id INTEGER PRIMARY KEY, name VARCHAR(63) NOT NULL, "
+                "address VARCHAR(256) NOT NULL, email VARCHAR(63) NOT NULL, password VARCHAR(20) NOT NULL, "
+                "phone_number VARCHAR(63), available BOOLEAN NOT NULL)"
+            ))
+            connection.execute(text(
+                "INSERT INTO customer VALUES (7, 'old', 'here', 'old@example.com', 'secret', NULL, TRUE)"
+            ))
+        try:
+            result = self.runner.invoke(db_upgrade)
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual(self.runner.invoke(db_upgrade).exit_code, 0)
+            self.assertEqual(Customer.query.get(7).version, 1)
+        finally:
+            db.session.remove()
+            db.drop_all()
+            db.create_all()
@@ -0,0 +1,79 @@
+"""
+Test cases for the JSON Provider module
+"""
+import datetime
+import decimal
+import json
+import uuid
+from dataclasses import dataclass
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import patch
+from flask import Flask
+from service.common import json_provider
+from service.common.json_provider import CompiledSerializer, FastJSONProvider
+
+
+@dataclass
+class Point:
+    """A dataclass to encode"""
+    latitude: int
+    longitude: int
+
+
+ROWS = [
+    SimpleNamespace(id=1, name="Zoë \"Z\"", available=True, phone_number=None),
+    SimpleNamespace(id=2, name="plain", available=False, phone_number="555"),
+]
+FIELDS = ("id", "name", "available", "phone_number")
+
+
+class TestJSONProvider(TestCase):
+    """Test Cases for the JSON encoding of responses"""
+
+    def test_dumps_and_loads(self):
+        """It should round trip values through dumps and loads"""
+        data = {"a": [1, 2.5, None, True], "b": "text"}
+        self.assertEqual(json_provider.loads(json_provider.dumps(data)), data)
+
+    def test_dumps_extra_types(self):
+        """It should encode dates, decimals, uuids and dataclasses"""
+        value = uuid.uuid4()
+        data = json_provider.loads(
+            json_provider.dumps(
+                [datetime.date(2023, 7, 1), decimal.Decimal("1.50"), value, Point(1, 2)]
+            )
+        )
+        self.assertEqual(data, ["2023-07-01", "1.50", str(value), {"latitude": 1, "longitude": 2}])
+        self.assertRaises(TypeError, json_provider.dumps, object())
+
+    def test_compiled_serializer(self):
+        """It should encode objects to the same JSON as json.dumps"""
+        serializer = CompiledSerializer(FIELDS)
+        expected = [{field: getattr(row, field) for field in FIELDS} for row in ROWS]
+        self.assertEqual(json.loads(serializer.one(ROWS[0])), expected[0])
+        self.assertEqual(json.loads(serializer.many(ROWS)), expected)
+        self.assertEqual(serializer.to_dict(ROWS[1]), expected[1])
+        self.assertEqual(json.loads(CompiledSerializer(["id"]).one(ROWS[1])), {"id": 2})
+
+    def test_standard_library_fallback(self):
+        """It should encode the same JSON without orjson"""
+        serializer = CompiledSerializer(FIELDS)
+        expected = [{field: getattr(row, field) for field in FIELDS} for row in ROWS]
+        with patch.object(json_provider, "orjson", None):
+            self.assertEqual(json.loads(serializer.many(ROWS)), expected)
+            self.assertEqual(json.loads(serializer.one(ROWS[0])), expected[0])
+            self.assertEqual(json.loads(json_provider.dumps({"d": decimal.Decimal("2")})), {"d": "2"})
+            self.assertEqual(json_provider.loads('{"a": 1}'), {"a": 1})
+            point = SimpleNamespace(value=datetime.date(2023, 7, 1))
+            self.assertEqual(json.loads(CompiledSerializer(["value"]).one(point)), {"value": "2023-07-01"})
+
+    def test_flask_provider(self):
+        """It should encode Flask responses"""
+        app = Flask(__name__)
+        app.json = FastJSONProvider(app)
+        with app.app_context():
+            resp = app.json.response({"a": 1})
+            self.assertEqual(resp.mimetype, "application/json")
+            self.assertEqual(app.json.loads(resp.get_data()), {"a": 1})
+            self.assertEqual(app.json.loads(app.json.dumps([1, 2])), [1, 2])
@@ -0,0 +1,90 @@
+"""
+Test cases for the Metrics module
+"""
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from service.common.metrics import Histogram, InstrumentedQueuePool, pool_stats, render_metrics
+
+
+class TestHistogram(TestCase):
+    """Test Cases for Histogram"""
+
+    def test_observe(self):
+        """It should count observations into cumulative buckets"""
+        histogram = Histogram(buckets=(0.1, 1.0))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot["buckets"], {"0.1": 1, "1.0": 2, "+Inf": 3})
+        self.assertEqual(snapshot["count"], 3)
+        self.assertAlmostEqual(snapshot["sum"], 5.55)
+
+    def test_empty(self):
+        """It should report zero observations"""
+        snapshot = Histogram().snapshot()
+        self.assertEqual(snapshot["count"], 0)
+        self.assertEqual(snapshot["sum"], 0)
+
+
+class TestInstrumentedQueuePool(TestCase):
+    """Test Cases for InstrumentedQueuePool"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        self.engine = create_engine(
+            f"sqlite:///{self.path}",
+            poolclass=InstrumentedQueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=0.01,
+        )
+
+    def tearDown(self):
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def test_pool_stats(self):
+        """It should report checked out connections and wait times"""
+        with self.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            stats = pool_stats(self.engine)
+            self.assertEqual(stats["pool"], "InstrumentedQueuePool")
+            self.assertEqual(stats["size"], 1)
+            self.assertEqual(stats["checked_out"], 1)
+            self.assertEqual(stats["max_overflow"], 0)
+        stats = pool_stats(self.engine)
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertEqual(stats["wait_time"]["count"], 1)
+        self.assertEqual(stats["timeouts"], 0)
+
+    def test_pool_timeout(self):
+        """It should count checkouts that time out"""
+        with self.engine.connect():
+            with self.assertRaises(PoolTimeoutError):
+                self.engine.connect()
+        stats = pool_stats(self.engine)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["wait_time"]["count"], 2)
+
+
+class TestRenderMetrics(TestCase):
+    """Test Cases for the Prometheus exposition"""
+
+    def test_render_metrics(self):
+        """It should render the metrics in Prometheus text format"""
+        body, content_type = render_metrics()
+        self.assertTrue(content_type.startswith("text/plain"))
+        self.assertIn(b"http_request_duration_seconds", body)
+
+    def test_render_multiprocess(self):
+        """It should add up the metrics written by every worker"""
+        with tempfile.TemporaryDirectory() as path:
+            with patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": path}):
+                body, _ = render_metrics()
+        self.assertEqual(body, b"")
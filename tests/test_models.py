@@ -4,9 +4,17 @@ Test cases for Customer Model
 import os
 import logging
 import unittest
+from unittest.mock import patch
 from werkzeug.exceptions import NotFound
-from service.models import Customer, db, DataValidationError
+from sqlalchemy import inspect
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
+from service.models import (
+    Customer, db, DataValidationError, DuplicateEmailError, VersionConflictError, encode_cursor, decode_cursor, customer_cache,
+    UnsupportedDatabaseError, check_dialect, customer_stats, parse_fields, stats_cache
+)
 from service import app
+from service.common.metrics import QueryCounter
 from tests.factories import CustomerFactory
 
 DATABASE_URI = os.getenv(
@@ -81,6 +89,8 @@ class TestCustomer(unittest.TestCase):
         self.assertEqual(len(same_name_customers), 3)
         for customer in same_name_customers:
             self.assertEqual(customer.name, "test name")
+        # the lookup ignores case
+        self.assertEqual(len(Customer.find_by_name("Test Name")), 3)
 
     def test_find_customer(self):
         """It should Find a Customer by ID"""
@@ -107,7 +117,7 @@ class TestCustomer(unittest.TestCase):
         count = len(
             [customer for customer in customers if customer.address == address])
         found = Customer.find_by_address(address)
-        self.assertEqual(found.count(), count)
+        self.assertEqual(len(found), count)
         for customer in found:
             self.assertEqual(customer.address, address)
 
@@ -117,12 +127,60 @@ class TestCustomer(unittest.TestCase):
         for customer in customers:
             customer.create()
         email = customers[0].email
-        count = len(
-            [customer for customer in customers if customer.email == email])
         found = Customer.find_by_email(email)
-        self.assertEqual(found.count(), count)
-        for customer in found:
-            self.assertEqual(customer.email, email)
+        self.assertEqual(found.id, customers[0].id)
+        self.assertEqual(found.email, email)
+        self.assertIsNone(Customer.find_by_email("nobody@example.com"))
+
+    def test_duplicate_email(self):
+        """It should not create or update a Customer with the email of another"""
+        first, second = CustomerFactory(), CustomerFactory()
+        first.create()
+        second.create()
+        self.assertRaises(DuplicateEmailError, CustomerFactory(email=first.email).create)
+        second.email = first.email
+        self.assertRaises(DuplicateEmailError, second.update)
+        self.assertEqual(len(Customer.all()), 2)
+
+    def test_rejected_values(self):
+        """It should not report values the database rejects as a duplicate email"""
+        self.assertRaises(DataValidationError, CustomerFactory(name=None).create)
+        customer = CustomerFactory()
+        customer.create()
+        customer.name = None
+        self.assertRaises(DataValidationError, customer.update)
+        self.assertIsNotNone(Customer.find(customer.id).name)
+
+    def test_bounded_finders(self):
+        """It should return at most limit Customers in id order"""
+        customers = CustomerFactory.create_batch(5, name="same", address="1 Main St", phone_number="555")
+        for customer in customers:
+            customer.create()
+        ids = [customer.id for customer in customers[:2]]
+        self.assertEqual([c.id for c in Customer.find_by_name("same", limit=2)], ids)
+        self.assertEqual([c.id for c in Customer.find_by_address("1 Main St", limit=2)], ids)
+        self.assertEqual([c.id for c in Customer.find_by_phone("555", limit=2)], ids)
+        self.assertEqual(len(Customer.find_by_availability(customers[0].available, limit=1)), 1)
+        self.assertRaises(DataValidationError, Customer.find_by_name, "same", limit=0)
+
+    def test_finders_unbounded_by_default(self):
+        """It should return every matching Customer when no limit is given"""
+        for customer in CustomerFactory.create_batch(5, name="same", address="1 Main St", phone_number="555"):
+            customer.create()
+        with patch("service.models.MAX_PAGE_SIZE", 3):
+            self.assertEqual(len(Customer.find_by_name("same")), 5)
+            self.assertEqual(len(Customer.find_by_address("1 Main St")), 5)
+            self.assertEqual(len(Customer.find_by_phone("555")), 5)
+            self.assertRaises(DataValidationError, Customer.find_by_name, "same", limit=4)
+
+    def test_stream_by(self):
+        """It should stream every matching Customer in id order"""
+        for available in (True, False, True, True):
+            CustomerFactory(available=available).create()
+        streamed = list(Customer.stream_by({"available": True}, batch_size=2))
+        self.assertEqual(len(streamed), 3)
+        self.assertTrue(all(customer.available for customer in streamed))
+        self.assertEqual([c.id for c in streamed], sorted(c.id for c in streamed))
 
     def test_find_or_404_found(self):
         """It should Find or return 404 not found for Customer"""
@@ -149,16 +207,15 @@ class TestCustomer(unittest.TestCase):
         db.session.add(available_customer)
         db.session.add(unavailable_customer)
         db.session.commit()
-        query = Customer.find_by_availability(False)
-        customers = query.all()  # 将查询转换为列表
+        customers = Customer.find_by_availability(False)
         self.assertEqual(len(customers), 1)
         self.assertEqual(customers[0].id, unavailable_customer.id)
         self.assertFalse(customers[0].available)
 
-    # def test_find_by_availability_empty(self):
-    #     """ Find Customers by availability - No Customers """
-    #     customers = Customer.find_by_availability(True)
-    #     self.assertEqual(len(customers), 0)
+    def test_find_by_availability_empty(self):
+        """ Find Customers by availability - No Customers """
+        customers = Customer.find_by_availability(True)
+        self.assertEqual(len(customers), 0)
 
     def test_find_by_phone_existing(self):
         """ Find Customers with an existing phone number """
@@ -203,6 +260,8 @@ class TestCustomer(unittest.TestCase):
         """This runs before each test"""
         db.session.query(Customer).delete()  # clean up the last tests
         db.session.commit()
+        customer_cache.clear()
+        stats_cache.clear()
 
     def tearDown(self):
         """This runs after each test"""
@@ -281,6 +340,23 @@ class TestCustomer(unittest.TestCase):
         self.assertEqual(customers[0].id, original_customer_id)
         self.assertEqual(customers[0].name, "customer2")
 
+    def test_write_without_reload(self):
+        """It should write a Customer in one statement and not read it back"""
+        customer = CustomerFactory()
+        with QueryCounter() as queries:
+            customer.create()
+            data = customer.serialize()
+        self.assertEqual(queries.count, 1, queries.statements)
+        self.assertEqual(data["id"], customer.id)
+        self.assertEqual(customer.version, 1)
+        customer.name = "renamed"
+        with QueryCounter() as queries:
+            customer.update()
+            data = customer.serialize()
+        self.assertEqual(queries.count, 1, queries.statements)
+        self.assertEqual(data["name"], "renamed")
+        self.assertEqual(customer.version, 2)
+
     def test_serialize_a_customer(self):
         """It should serialize a Customer"""
         customer = CustomerFactory()
@@ -325,3 +401,252 @@ class TestCustomer(unittest.TestCase):
         customer.delete()
         customer = Customer.all()
         self.assertEqual(len(customer), 0)
+
+    def test_delete_changed_customer(self):
+        """It should not delete a Customer changed since it was read"""
+        customer = CustomerFactory()
+        customer.create()
+        customer = Customer.find(customer.id)
+        # another worker changes the row without this worker knowing
+        db.session.execute(db.update(Customer.__table__).values(version=Customer.__table__.c.version + 1))
+        db.session.commit()
+        self.assertRaises(VersionConflictError, customer.delete)
+        Customer.find(customer.id).delete()
+        self.assertEqual(Customer.all(), [])
+
+    def test_paginate_customers(self):
+        """It should page through Customers in id order with a cursor"""
+        for customer in CustomerFactory.create_batch(5):
+            customer.create()
+        first_page, cursor = Customer.paginate(2)
+        self.assertEqual(len(first_page), 2)
+        self.assertIsNotNone(cursor)
+        second_page, cursor = Customer.paginate(2, cursor)
+        self.assertEqual(len(second_page), 2)
+        self.assertGreater(second_page[0].id, first_page[-1].id)
+        last_page, cursor = Customer.paginate(2, cursor)
+        self.assertEqual(len(last_page), 1)
+        self.assertIsNone(cursor)
+        ids = [customer.id for customer in first_page + second_page + last_page]
+        self.assertEqual(ids, sorted(customer.id for customer in Customer.all()))
+
+    def test_query_by(self):
+        """It should AND every filter into one query and sort the result"""
+        for name, available in (("Ann", True), ("ann", False), ("Bob", True), ("Cy", True)):
+            CustomerFactory(name=name, available=available).create()
+        customers = Customer.query_by({"name": "ANN", "available": True}).all()
+        self.assertEqual([customer.name for customer in customers], ["Ann"])
+        customers = Customer.query_by({"available": True}, sort="name", order="desc").all()
+        self.assertEqual([customer.name for customer in customers], ["Cy", "Bob", "Ann"])
+        self.assertEqual(Customer.query_by().count(), 4)
+
+    def test_query_by_bad_request(self):
+        """It should not query by unknown filters or sorts"""
+        self.assertRaises(DataValidationError, Customer.query_by, {"password": "x"})
+        self.assertRaises(DataValidationError, Customer.query_by, sort="password")
+        self.assertRaises(DataValidationError, Customer.query_by, order="sideways")
+        self.assertRaises(DataValidationError, Customer.query_by, {"available": "yes"})
+        self.assertRaises(DataValidationError, Customer.query_by, {"id": True})
+
+    def test_paginate_filtered(self):
+        """It should page through only the Customers that match the filters"""
+        for available in (True, False, True, False, True):
+            CustomerFactory(available=available).create()
+        page, cursor = Customer.paginate(2, filters={"available": True})
+        self.assertEqual(len(page), 2)
+        page, cursor = Customer.paginate(2, cursor, filters={"available": True})
+        self.assertEqual(len(page), 1)
+        self.assertIsNone(cursor)
+        self.assertTrue(page[0].available)
+
+    def test_search(self):
+        """It should find Customers by parts of their name, email or address"""
+        CustomerFactory(name="Ann Smith", email="ann@example.com", address="1 Elm St").create()
+        CustomerFactory(name="Joanne Smithers", email="jo@example.com", address="2 Oak St").create()
+        CustomerFactory(name="Bob Jones", email="annex@bob.io", address="3 Pine St").create()
+        names = [customer.name for customer in Customer.search("ann")]
+        self.assertEqual(names, ["Ann Smith", "Bob Jones", "Joanne Smithers"])
+        names = [customer.name for customer in Customer.search("SMITH  ann")]
+        self.assertEqual(names, ["Ann Smith", "Joanne Smithers"])
+        self.assertEqual([c.name for c in Customer.search("oak st")], ["Joanne Smithers"])
+        self.assertEqual(len(Customer.search("example", limit=1)), 1)
+        self.assertEqual(Customer.search("100%"), [])
+
+    def test_count(self):
+        """It should count the Customers matching the filters"""
+        for available in (True, True, True, False, False):
+            CustomerFactory(available=available).create()
+        self.assertEqual(Customer.count(), 5)
+        self.assertEqual(Customer.count({"available": False}), 2)
+        self.assertEqual(Customer.count({"available": True, "name": "no such name"}), 0)
+
+    def test_stats(self):
+        """It should count Customers by availability in one query and cache it"""
+        self.assertEqual(customer_stats(), {"total": 0, "available": 0, "suspended": 0})
+        stats_cache.clear()
+        for _ in range(3):
+            CustomerFactory(available=True).create()
+        for _ in range(2):
+            CustomerFactory(available=False).create()
+        with QueryCounter() as queries:
+            self.assertEqual(customer_stats(), {"total": 5, "available": 3, "suspended": 2})
+        self.assertEqual(queries.count, 1)
+        CustomerFactory(available=False).create()
+        with QueryCounter() as queries:
+            self.assertEqual(customer_stats()["total"], 5)
+        self.assertEqual(queries.count, 0)
+
+    def test_search_index(self):
+        """It should build the trigram search index only on PostgreSQL"""
+        index = next(ix for ix in Customer.__table__.indexes if ix.name == "ix_customer_search_trgm")
+        ddl = str(CreateIndex(index).compile(dialect=postgresql.dialect()))
+        self.assertIn("USING gin", ddl)
+        self.assertIn("gin_trgm_ops", ddl)
+        built = [ix["name"] for ix in inspect(db.engine).get_indexes("customer")]
+        self.assertEqual("ix_customer_search_trgm" in built, db.engine.dialect.name == "postgresql")
+
+    def test_search_bad_request(self):
+        """It should not search for too little text or with a bad limit"""
+        self.assertRaises(DataValidationError, Customer.search, " a ")
+        self.assertRaises(DataValidationError, Customer.search, "ann", limit=0)
+        self.assertRaises(DataValidationError, Customer.search, "ann", limit=1000)
+
+    def test_paginate_bad_limit(self):
+        """It should not paginate with a limit out of range"""
+        self.assertRaises(DataValidationError, Customer.paginate, 0)
+        self.assertRaises(DataValidationError, Customer.paginate, 100000)
+
+    def test_cursor_round_trip(self):
+        """It should decode a cursor back to the id it was encoded from"""
+        self.assertEqual(decode_cursor(encode_cursor(42)), 42)
+
+    def test_decode_bad_cursor(self):
+        """It should raise a DataValidationError for a malformed cursor"""
+        self.assertRaises(DataValidationError, decode_cursor, "not-a-cursor")
+        self.assertRaises(DataValidationError, decode_cursor, encode_cursor(1).upper())
+
+    def test_stream_by_without_filters(self):
+        """It should stream every Customer in id order"""
+        for customer in CustomerFactory.create_batch(5):
+            customer.create()
+        streamed = list(Customer.stream_by(batch_size=2))
+        self.assertEqual(len(streamed), 5)
+        self.assertEqual(
+            [customer.id for customer in streamed],
+            sorted(customer.id for customer in Customer.all()),
+        )
+
+    def test_find_reads_through_cache(self):
+        """It should serve a repeated find from the cache"""
+        customer = CustomerFactory()
+        customer.create()
+        db.session.expunge_all()
+        hits = customer_cache.stats()["hits"]
+        Customer.find(customer.id)
+        db.session.expunge_all()
+        found = Customer.find(customer.id)
+        self.assertEqual(customer_cache.stats()["hits"], hits + 1)
+        self.assertEqual(found.serialize(), customer.serialize())
+
+    def test_find_with_stale_cache(self):
+        """It should return the session's newer copy rather than a stale cached one"""
+        customer = CustomerFactory()
+        customer.create()
+        customer_id = customer.id
+        db.session.expunge_all()
+        Customer.find(customer_id)  # caches version 1
+        db.session.expunge_all()
+        # another worker bumps the version without this worker's cache knowing
+        with db.engine.begin() as connection:
+            connection.execute(
+                db.update(Customer.__table__).values(name="newer", version=Customer.__table__.c.version + 2)
+            )
+        loaded = Customer.all()  # keeps version 3 in the session
+        found = Customer.find(customer_id)
+        self.assertIs(found, loaded[0])
+        self.assertEqual((found.version, found.name), (3, "newer"))
+        self.assertIsNone(customer_cache.get(customer_id))
+        db.session.expunge_all()
+        self.assertEqual(Customer.find(customer_id).version, 3)
+
+    def test_update_invalidates_cache(self):
+        """It should not serve a stale Customer after an update"""
+        customer = CustomerFactory()
+        customer.create()
+        customer_id = customer.id
+        found = Customer.find(customer_id)
+        found.name = "renamed"
+        found.update()
+        db.session.expunge_all()
+        self.assertEqual(Customer.find(customer_id).name, "renamed")
+
+    def test_delete_invalidates_cache(self):
+        """It should not find a Customer from the cache after a delete"""
+        customer = CustomerFactory()
+        customer.create()
+        Customer.find(customer.id).delete()
+        self.assertIsNone(Customer.find(customer.id))
+
+    def test_update_bumps_version(self):
+        """It should bump the version of a Customer on every update"""
+        customer = CustomerFactory()
+        customer.create()
+        self.assertEqual(customer.version, 1)
+        etag = customer.etag
+        customer.name = "renamed"
+        customer.update()
+        self.assertEqual(customer.version, 2)
+        self.assertNotEqual(customer.etag, etag)
+
+    def test_update_version_conflict(self):
+        """It should not update a Customer changed since it was read"""
+        if not db.engine.dialect.supports_sane_rowcount_returning:
+            self.skipTest("the database cannot report rows matched by UPDATE ... RETURNING")
+        customer = CustomerFactory()
+        customer.create()
+        customer_id = customer.id
+        self.assertEqual(customer.version, 1)
+        # another writer bumps the version behind the session's back
+        db.session.execute(
+            db.update(Customer.__table__)
+            .where(Customer.__table__.c.id == customer_id)
+            .values(version=Customer.__table__.c.version + 1)
+        )
+        customer.name = "lost update"
+        self.assertRaises(VersionConflictError, customer.update)
+        self.assertNotEqual(Customer.find(customer_id).name, "lost update")
+
+    def test_check_dialect(self):
+        """It should only run on the supported databases"""
+        check_dialect(db.engine)
+        with patch.object(db.engine.dialect, "name", "mysql"):
+            self.assertRaises(UnsupportedDatabaseError, check_dialect, db.engine)
+
+    def test_parse_fields(self):
+        """It should parse a sparse fieldset in serialized order"""
+        self.assertEqual(parse_fields("available, name"), ("id", "name", "available"))
+        self.assertEqual(parse_fields("id"), ("id",))
+        self.assertRaises(DataValidationError, parse_fields, "name,version")
+
+    def test_all_loads_only_fields(self):
+        """It should only SELECT the requested columns"""
+        for customer in CustomerFactory.create_batch(2):
+            customer.create()
+        db.session.expunge_all()
+        for customer in Customer.all(fields=("id", "name")):
+            unloaded = inspect(customer).unloaded
+            self.assertIn("address", unloaded)
+            self.assertIn("password", unloaded)
+            self.assertNotIn("name", unloaded)
+            self.assertNotIn("version", unloaded)
+
+    def test_find_loads_only_fields(self):
+        """It should only SELECT the requested columns of an uncached Customer"""
+        customer = CustomerFactory()
+        customer.create()
+        customer_id = customer.id
+        db.session.expunge_all()
+        found = Customer.find(customer_id, fields=("id", "available"))
+        self.assertIn("address", inspect(found).unloaded)
+        self.assertEqual(customer_cache.stats()["size"], 0)
+        self.assertIsNone(Customer.find(0, fields=("id",)))
@@ -13,8 +13,9 @@ import json
 from unittest import TestCase
 from unittest.mock import patch
 from service import app
-from service.models import db, init_db, Customer
+from service.models import db, init_db, Customer, VersionConflictError, customer_cache, stats_cache
 from service.common import status  # HTTP Status Codes
+from service.common.metrics import QueryCounter
 from tests.factories import CustomerFactory
 
 DATABASE_URI = os.getenv(
@@ -51,6 +52,8 @@ class TestYourResourceServer(TestCase):
         self.client = app.test_client()
         db.session.query(Customer).delete()
         db.session.commit()
+        customer_cache.clear()
+        stats_cache.clear()
         self.app = app.test_client()
         self.app.testing = True
         self.phone_number = "123-456-7890"
@@ -126,7 +129,7 @@ class TestYourResourceServer(TestCase):
 
     def test_update_customers(self):
         """Factory method to create customers in bulk"""
-        test_customer = self._create_customers(1)[0]
+        test_customer = CustomerFactory()
         response = self.client.post(
             f"{BASE_URL}",
             json=test_customer.serialize(),
@@ -171,6 +174,78 @@ class TestYourResourceServer(TestCase):
         resp = self.client.get(f"{BASE_URL}/{customer_id}")
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_reads_return_to_replicas_after_write(self):
+        """It should read from the replicas again in the request after a write"""
+        with patch("service.common.routing.RoutingSession._replica", return_value=None) as replica:
+            resp = self.client.post(BASE_URL, json=CustomerFactory().serialize())
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+            replica.assert_not_called()
+            resp = self.client.get(BASE_URL)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            replica.assert_called()
+
+    def test_update_stale_cached_customer(self):
+        """It should update a customer whose cached copy is stale"""
+        customer = self._create_customers(1)[0]
+        resp = self.client.get(f"{BASE_URL}/{customer.id}")
+        self.assertEqual(resp.headers["ETag"], f'"{customer.id}-1"')
+        db.session.expunge_all()  # the next request starts from the cached copy
+        # another worker renames the customer, this worker's cache keeps version 1
+        with db.engine.begin() as connection:
+            connection.execute(
+                db.update(Customer.__table__).values(name="other", version=Customer.__table__.c.version + 1)
+            )
+        body = dict(customer.serialize(), name="mine")
+        resp = self.client.put(f"{BASE_URL}/{customer.id}", json=body)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["ETag"], f'"{customer.id}-3"')
+        db.session.expunge_all()
+        # the ETag of the stored row matches even though the cache was stale
+        with db.engine.begin() as connection:
+            connection.execute(db.update(Customer.__table__).values(version=Customer.__table__.c.version + 1))
+        body["name"] = "mine again"
+        resp = self.client.put(f"{BASE_URL}/{customer.id}", json=body, headers={"If-Match": f'"{customer.id}-4"'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["ETag"], f'"{customer.id}-5"')
+        resp = self.client.put(f"{BASE_URL}/{customer.id}", json=body, headers={"If-Match": f'"{customer.id}-4"'})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_update_retries_version_conflict(self):
+        """It should retry an update without If-Match once when the Customer changed meanwhile"""
+        customer = self._create_customers(1)[0]
+        body = dict(customer.serialize(), name="mine")
+        conflict = VersionConflictError("changed by another request")
+        with patch.object(Customer, "update", side_effect=[conflict, None]) as update:
+            resp = self.client.put(f"{BASE_URL}/{customer.id}", json=body)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(update.call_count, 2)
+        with patch.object(Customer, "update", side_effect=[conflict, conflict]):
+            resp = self.client.put(f"{BASE_URL}/{customer.id}", json=body)
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        db.session.rollback()  # the mocked updates left their changes unwritten
+        with patch.object(Customer, "update", side_effect=[conflict]) as update:
+            resp = self.client.put(f"{BASE_URL}/{customer.id}", json=body, headers={"If-Match": f'"{customer.id}-1"'})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(update.call_count, 1)
+
+    def test_delete_stale_cached_customer(self):
+        """It should delete a customer whose cached copy is stale"""
+        customer = self._create_customers(1)[0]
+        resp = self.client.get(f"{BASE_URL}/{customer.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        # another worker suspends the customer, this worker's cache keeps version 1
+        db.session.execute(
+            db.update(Customer.__table__).values(available=False, version=Customer.__table__.c.version + 1)
+        )
+        db.session.commit()
+        resp = self.client.delete(f"{BASE_URL}/{customer.id}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.client.get(f"{BASE_URL}/{customer.id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.get(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), [])
+
     # def test_delete_not_found(self):
     #     """It should not delete a customer thats not found"""
     #     resp = self.client.delete(f"{BASE_URL}/-1")
@@ -275,6 +350,19 @@ class TestYourResourceServer(TestCase):
         customer = response.get_json()
         self.assertEqual(customer["available"], True)
 
+    def test_suspend_and_activate_etag(self):
+        """It should return the ETag of the changed Customer for If-Match"""
+        customer = self._create_customers(1)[0]
+        response = self.client.put(f"{BASE_URL}/{customer.id}/suspend")
+        etag = response.headers["ETag"]
+        self.assertEqual(etag, f'"{customer.id}-2"')
+        response = self.client.put(
+            f"{BASE_URL}/{customer.id}", json=dict(customer.serialize(), name="renamed"), headers={"If-Match": etag}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.put(f"{BASE_URL}/{customer.id}/activate")
+        self.assertEqual(response.headers["ETag"], f'"{customer.id}-4"')
+
     def test_suspend_customer_not_found(self):
         """It should not Suspend a Customer that does not exist"""
 
@@ -307,19 +395,180 @@ class TestYourResourceServer(TestCase):
         data = resp.get_json()
         self.assertTrue(all(cust['available'] for cust in data))
 
-    @patch.object(Customer, 'find_by_phone')
-    def test_find_by_phone(self, mock_find_by_phone):
+    @patch.object(Customer, 'query_by')
+    def test_find_by_phone(self, mock_query_by):
         """
         to test whether we can list customers by searching phone number.
         """
         mock_customers = [Customer(phone_number=self.phone_number)]
-        mock_find_by_phone.return_value = mock_customers
+        mock_query_by.return_value.all.return_value = mock_customers
 
         response = self.app.get(f'/api/customers?phone_number={self.phone_number}')
         self.assertEqual(response.status_code, 200)
         results = json.loads(response.data)
         self.assertEqual(len(results), 1)
         self.assertEqual(results[0]['phone_number'], self.phone_number)
+        mock_query_by.assert_called_once_with({"phone_number": self.phone_number}, None, "asc")
+
+    def test_create_duplicate_email(self):
+        """It should not create or update a Customer with the email of another"""
+        customers = self._create_customers(2)
+        first, second = customers[0], customers[1]
+        resp = self.client.post(BASE_URL, json=dict(CustomerFactory().serialize(), email=first.email))
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.client.put(f"{BASE_URL}/{second.id}", json=dict(second.serialize(), email=first.email))
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
+    def test_create_rejected_values(self):
+        """It should answer values the database rejects with 400, not 409"""
+        resp = self.client.post(BASE_URL, json=dict(CustomerFactory().serialize(), name=None))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        customer = self._create_customers(1)[0]
+        resp = self.client.put(f"{BASE_URL}/{customer.id}", json=dict(customer.serialize(), name=None))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_upsert_rejected_values(self):
+        """It should answer an upsert with values the database rejects with 400"""
+        data = CustomerFactory().serialize()
+        url = f"{BASE_URL}/by-email/{data['email']}"
+        resp = self.client.put(url, json=dict(data, name=None))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.put(url, json=dict(data, available="notabool"))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_upsert_customer(self):
+        """It should create a Customer by email and then update it"""
+        data = CustomerFactory().serialize()
+        url = f"{BASE_URL}/by-email/{data['email']}"
+        resp = self.client.put(url, json=dict(data, email="ignored@example.com"))
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertIn("Location", resp.headers)
+        created = resp.get_json()
+        self.assertEqual(created["email"], data["email"])
+
+        resp = self.client.put(url, json=dict(data, name="renamed"))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["id"], created["id"])
+        self.assertEqual(resp.headers["ETag"], f'"{created["id"]}-2"')
+        resp = self.client.get(f"{BASE_URL}/{created['id']}")
+        self.assertEqual(resp.get_json()["name"], "renamed")
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 1)
+
+    def test_upsert_customer_bad_request(self):
+        """It should not upsert a Customer from bad data"""
+        resp = self.client.put(f"{BASE_URL}/by-email/a@example.com", json={"name": "only"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.put(f"{BASE_URL}/by-email/a@example.com", json=[1])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_upsert_customers(self):
+        """It should create and update many Customers by email"""
+        existing = self._create_customers(1)[0]
+        rows = [dict(existing.serialize(), name="updated"), CustomerFactory().serialize()]
+        resp = self.client.put(f"{BASE_URL}/by-email", json=rows)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["updated"], [{"index": 0, "id": existing.id}])
+        self.assertEqual([row["index"] for row in data["created"]], [1])
+        self.assertEqual(data["errors"], [])
+        resp = self.client.put(f"{BASE_URL}/by-email", json={"not": "a list"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_query_combined_filters(self):
+        """It should AND every filter given into one query"""
+        customers = self._create_customers(4)
+        target = customers[0]
+        resp = self.client.get(
+            BASE_URL,
+            query_string={"name": target.name.upper(), "available": str(target.available).lower()},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertTrue(data)
+        for row in data:
+            self.assertEqual(row["name"].lower(), target.name.lower())
+            self.assertEqual(row["available"], target.available)
+
+        resp = self.client.get(BASE_URL, query_string={"email": target.email, "address": target.address})
+        self.assertEqual([row["id"] for row in resp.get_json()], [target.id])
+
+        resp = self.client.get(BASE_URL, query_string={"email": target.email, "address": "elsewhere"})
+        self.assertEqual(resp.get_json(), [])
+
+    def test_query_unavailable(self):
+        """It should filter on available=false"""
+        self._create_customers(5)
+        resp = self.client.get(BASE_URL, query_string={"available": "false"})
+        data = resp.get_json()
+        self.assertEqual(len(data), Customer.query.filter_by(available=False).count())
+        self.assertFalse(any(row["available"] for row in data))
+
+    def test_search_customers(self):
+        """It should search Customers and return the best matches first"""
+        CustomerFactory(name="Zed Annable", email="zed@example.com").create()
+        CustomerFactory(name="Anna Bell", email="anna@example.com").create()
+        resp = self.client.get(f"{BASE_URL}/search", query_string={"q": "anna", "fields": "name"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([row["name"] for row in data], ["Anna Bell", "Zed Annable"])
+        self.assertEqual(set(data[0]), {"id", "name"})
+        resp = self.client.get(f"{BASE_URL}/search", query_string={"q": "anna", "limit": 1})
+        self.assertEqual(len(resp.get_json()), 1)
+
+    def test_customer_stats(self):
+        """It should count Customers by availability"""
+        for _ in range(3):
+            CustomerFactory(available=True).create()
+        CustomerFactory(available=False).create()
+        resp = self.client.get(f"{BASE_URL}/stats")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"total": 4, "available": 3, "suspended": 1})
+
+    def test_count_only(self):
+        """It should return only the number of Customers matching the filters"""
+        for _ in range(3):
+            CustomerFactory(available=True).create()
+        for _ in range(2):
+            CustomerFactory(available=False).create()
+        resp = self.client.get(BASE_URL, query_string={"count_only": "true"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"count": 5})
+        resp = self.client.get(BASE_URL, query_string={"count_only": "true", "available": "false"})
+        self.assertEqual(resp.get_json(), {"count": 2})
+
+    def test_search_bad_request(self):
+        """It should not search without enough text"""
+        resp = self.client.get(f"{BASE_URL}/search")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(f"{BASE_URL}/search", query_string={"q": "a"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_query_sorted(self):
+        """It should sort Customers by a field in either order"""
+        self._create_customers(5)
+        resp = self.client.get(BASE_URL, query_string={"sort": "name", "order": "desc"})
+        names = [row["name"] for row in resp.get_json()]
+        self.assertEqual(names, sorted(names, reverse=True))
+        resp = self.client.get(BASE_URL, query_string={"sort": "password"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL, query_string={"sort": "name", "limit": 2})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_query_filtered_pages(self):
+        """It should page through filtered Customers and keep the filter in the next link"""
+        for customer in CustomerFactory.create_batch(5, available=True):
+            customer.create()
+        CustomerFactory(available=False).create()
+        resp = self.client.get(BASE_URL, query_string={"available": "true", "limit": 3})
+        self.assertEqual(len(resp.get_json()), 3)
+        self.assertIn("available=True", resp.headers["Link"])
+        resp = self.client.get(
+            BASE_URL, query_string={"available": "true", "limit": 3, "cursor": resp.headers["X-Next-Cursor"]}
+        )
+        data = resp.get_json()
+        self.assertEqual(len(data), 2)
+        self.assertTrue(all(row["available"] for row in data))
+        self.assertNotIn("Link", resp.headers)
 
     @patch.object(Customer, 'find')
     def test_get_customer_by_id(self, mock_find):
@@ -352,3 +601,369 @@ class TestYourResourceServer(TestCase):
         self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
         data = json.loads(response.data)
         self.assertEqual(data["message"], "Content-Type must be application/json")
+
+    def test_list_customers_paginated(self):
+        """It should page through the Customer list with limit and cursor"""
+        self._create_customers(5)
+        resp = self.client.get(BASE_URL, query_string={"limit": 2})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 2)
+        self.assertIn('rel="next"', resp.headers["Link"])
+        seen = [customer["id"] for customer in resp.get_json()]
+        while "X-Next-Cursor" in resp.headers:
+            resp = self.client.get(
+                BASE_URL,
+                query_string={"limit": 2, "cursor": resp.headers["X-Next-Cursor"]},
+            )
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            seen.extend(customer["id"] for customer in resp.get_json())
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(seen, sorted(seen))
+
+    def test_list_customers_bad_cursor(self):
+        """It should not list Customers with a malformed cursor"""
+        resp = self.client.get(BASE_URL, query_string={"cursor": "garbage"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bad_request_outside_testing(self):
+        """It should answer invalid arguments with 400 when exceptions do not propagate"""
+        app.config["TESTING"] = False
+        try:
+            for path, args in (
+                (BASE_URL, {"cursor": "garbage"}),
+                (BASE_URL, {"limit": 0}),
+                (BASE_URL, {"limit": 5000}),
+                (f"{BASE_URL}/search", {"q": "anna", "limit": 0}),
+            ):
+                resp = self.client.get(path, query_string=args)
+                self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, (path, args))
+                self.assertIn("message", resp.get_json())
+        finally:
+            app.config["TESTING"] = True
+
+    def test_export_customers(self):
+        """It should export all Customers as newline-delimited JSON"""
+        customers = self._create_customers(3)
+        resp = self.client.get(f"{BASE_URL}/export")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 3)
+        exported = [json.loads(line) for line in lines]
+        self.assertEqual(
+            sorted(row["id"] for row in exported),
+            sorted(customer.id for customer in customers),
+        )
+
+    def test_bulk_create_customers(self):
+        """It should create Customers from a JSON array"""
+        rows = [CustomerFactory().serialize() for _ in range(3)]
+        rows.append({"name": "missing everything else"})
+        resp = self.client.post(f"{BASE_URL}/bulk", json=rows)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data["created"]), 3)
+        self.assertEqual([error["index"] for error in data["errors"]], [3])
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 3)
+
+    def test_bulk_create_customers_ndjson(self):
+        """It should create Customers from newline-delimited JSON"""
+        lines = [json.dumps(CustomerFactory().serialize()) for _ in range(2)]
+        lines.append("{not json")
+        resp = self.client.post(
+            f"{BASE_URL}/bulk",
+            data="\n".join(lines) + "\n",
+            content_type="application/x-ndjson",
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data["created"]), 2)
+        self.assertEqual([error["index"] for error in data["errors"]], [2])
+
+    def test_bulk_create_not_a_list(self):
+        """It should not bulk create from a JSON object"""
+        resp = self.client.post(f"{BASE_URL}/bulk", json=CustomerFactory().serialize())
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_create_no_content_type(self):
+        """It should not bulk create without a Content-Type"""
+        resp = self.client.post(f"{BASE_URL}/bulk", data="[]")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_bulk_suspend_and_activate(self):
+        """It should suspend and then activate many Customers by id"""
+        customers = self._create_customers(4)
+        ids = [customer.id for customer in customers[:2]]
+        resp = self.client.put(f"{BASE_URL}/bulk/suspend", json={"ids": ids, "returning": True})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["count"], 2)
+        self.assertEqual(sorted(data["ids"]), sorted(ids))
+        for customer_id in ids:
+            self.assertFalse(self.client.get(f"{BASE_URL}/{customer_id}").get_json()["available"])
+
+        resp = self.client.put(f"{BASE_URL}/bulk/activate", json={"filter": {"available": False}})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotIn("ids", resp.get_json())
+        for customer_id in ids:
+            self.assertTrue(self.client.get(f"{BASE_URL}/{customer_id}").get_json()["available"])
+
+    def test_bulk_unknown_action(self):
+        """It should not run an unknown bulk action"""
+        resp = self.client.put(f"{BASE_URL}/bulk/explode", json={"ids": [1]})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_bulk_update_customers(self):
+        """It should write values to many Customers matching a filter"""
+        customers = self._create_customers(3)
+        resp = self.client.patch(
+            f"{BASE_URL}/bulk",
+            json={"ids": [customers[0].id], "values": {"name": "renamed"}},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["count"], 1)
+        data = self.client.get(f"{BASE_URL}/{customers[0].id}").get_json()
+        self.assertEqual(data["name"], "renamed")
+
+    def test_bulk_update_bad_selection(self):
+        """It should not bulk update with a malformed selection"""
+        for body in (
+            [1, 2],
+            {"ids": "1,2", "values": {"name": "x"}},
+            {"filter": ["name"], "values": {"name": "x"}},
+            {"values": {"name": "x"}},
+        ):
+            resp = self.client.patch(f"{BASE_URL}/bulk", json=body)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, body)
+
+    def test_bulk_update_bad_values(self):
+        """It should not bulk update with values the table cannot hold"""
+        customers = self._create_customers(2)
+        first, second = customers[0], customers[1]
+        ids = [first.id, second.id]
+        for body in (
+            {"ids": ids, "values": {"name": None}},
+            {"ids": ids, "values": {"email": "a@example.com"}},
+            {"ids": ids, "filter": {"name": "nobody"}, "values": {"name": "x"}},
+        ):
+            resp = self.client.patch(f"{BASE_URL}/bulk", json=body)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, body)
+        resp = self.client.patch(f"{BASE_URL}/bulk", json={"ids": [second.id], "values": {"email": first.email}})
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
+    def test_bulk_delete_customers(self):
+        """It should dry run and then delete many Customers"""
+        customers = self._create_customers(3)
+        ids = [customer.id for customer in customers[:2]]
+        resp = self.client.delete(f"{BASE_URL}/bulk", json={"ids": ids, "dry_run": True})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"count": 2, "dry_run": True})
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 3)
+
+        resp = self.client.delete(f"{BASE_URL}/bulk", json={"ids": ids})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"count": 2, "dry_run": False})
+        remaining = self.client.get(BASE_URL).get_json()
+        self.assertEqual([customer["id"] for customer in remaining], [customers[2].id])
+
+    def test_bulk_delete_no_selection(self):
+        """It should not bulk delete without a selection"""
+        resp = self.client.delete(f"{BASE_URL}/bulk", json={})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_delete_bad_filter(self):
+        """It should not bulk delete with filter values the columns cannot hold"""
+        self._create_customers(2)
+        for selection in ({"available": "yes"}, {"name": 5}):
+            resp = self.client.delete(f"{BASE_URL}/bulk", json={"filter": selection})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, selection)
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 2)
+
+    def test_cache_stats(self):
+        """It should report the Customer cache counters"""
+        customer = self._create_customers(1)[0]
+        self.client.get(f"{BASE_URL}/{customer.id}")
+        self.client.get(f"{BASE_URL}/{customer.id}")
+        resp = self.client.get("/cache/stats")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        for counter in ("size", "maxsize", "hits", "misses", "evictions"):
+            self.assertIn(counter, data)
+        self.assertGreaterEqual(data["hits"], 1)
+
+    def test_pool_stats(self):
+        """It should report the state of the database connection pool"""
+        self._create_customers(1)
+        resp = self.client.get("/pool/stats")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["pool"], "InstrumentedQueuePool")
+        for counter in ("size", "checked_in", "checked_out", "overflow", "timeouts"):
+            self.assertIn(counter, data)
+        self.assertGreaterEqual(data["wait_time"]["count"], 1)
+
+    def test_health(self):
+        """It should answer the liveness probe"""
+        resp = self.client.get("/health")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["status"], "OK")
+
+    def test_ready(self):
+        """It should answer the readiness probe while the database answers"""
+        resp = self.client.get("/ready")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["database"], "OK")
+
+    @patch("service.routes.readiness.check")
+    def test_not_ready(self, check_mock):
+        """It should fail the readiness probe when the database is down"""
+        check_mock.return_value = (False, "OperationalError")
+        resp = self.client.get("/ready")
+        self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(resp.get_json()["database"], "OperationalError")
+
+    def test_metrics(self):
+        """It should export request and database metrics for each resource"""
+        customer = self._create_customers(1)[0]
+        self.client.get(f"{BASE_URL}/{customer.id}")
+        resp = self.client.get("/metrics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        body = resp.get_data(as_text=True)
+        self.assertIn('http_requests_total{endpoint="customer_resource",method="GET",status="200"}', body)
+        self.assertIn('http_request_duration_seconds_bucket{endpoint="customer_resource"', body)
+        self.assertIn('http_response_size_bytes_count{endpoint="customer_resource"', body)
+        self.assertIn('db_queries_per_request_count{endpoint="customer_collection",method="POST"}', body)
+
+    def test_server_timing(self):
+        """It should report the time spent in the database in Server-Timing"""
+        customer = self._create_customers(1)[0]
+        customer_cache.clear()
+        resp = self.client.get(f"{BASE_URL}/{customer.id}")
+        self.assertRegex(resp.headers["Server-Timing"], r'^db;dur=[0-9.]+;desc="1 queries", app;dur=[0-9.]+$')
+
+    def test_slow_and_repeated_queries(self):
+        """It should log slow and repeated queries with their route"""
+        customer = self._create_customers(1)[0]
+        with patch.dict(app.config, {"SLOW_QUERY_THRESHOLD": 1e-9, "REPEATED_QUERY_THRESHOLD": 1}):
+            with self.assertLogs("flask.app", level="WARNING") as logs:
+                self.client.get(f"{BASE_URL}?name={customer.name}")
+        output = "\n".join(logs.output)
+        self.assertIn("Slow query took", output)
+        self.assertIn(f"Query repeated 1 times in GET {BASE_URL}", output)
+
+    def test_query_budget(self):
+        """It should stay within the query budget of each endpoint"""
+        customer = self._create_customers(1)[0]
+        new_customer = CustomerFactory().serialize()
+        budgets = [
+            (1, lambda: self.client.get(f"{BASE_URL}/{customer.id}")),
+            (0, lambda: self.client.get(f"{BASE_URL}/{customer.id}")),
+            (1, lambda: self.client.get(BASE_URL)),
+            (1, lambda: self.client.post(BASE_URL, json=new_customer)),
+            (2, lambda: self.client.put(f"{BASE_URL}/{customer.id}", json=dict(customer.serialize(), name="budget"))),
+            (1, lambda: self.client.put(f"{BASE_URL}/{customer.id}/suspend")),
+            (2, lambda: self.client.delete(f"{BASE_URL}/{customer.id}")),
+        ]
+        customer_cache.clear()
+        for budget, call in budgets:
+            with QueryCounter() as queries:
+                resp = call()
+            self.assertLess(resp.status_code, 300)
+            self.assertLessEqual(queries.count, budget, queries.statements)
+
+    def test_get_customer_etag(self):
+        """It should answer a matching If-None-Match with 304 Not Modified"""
+        customer = self._create_customers(1)[0]
+        resp = self.client.get(f"{BASE_URL}/{customer.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        etag = resp.headers["ETag"]
+        self.assertFalse(etag.startswith("W/"))
+
+        resp = self.client.get(f"{BASE_URL}/{customer.id}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.data, b"")
+        self.assertEqual(resp.headers["ETag"], etag)
+
+        # a change to the customer changes its ETag
+        customer.name = "changed"
+        self.client.put(f"{BASE_URL}/{customer.id}", json=customer.serialize())
+        resp = self.client.get(f"{BASE_URL}/{customer.id}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_list_customers_etag(self):
+        """It should answer a list request with a matching ETag with 304"""
+        self._create_customers(2)
+        resp = self.client.get(BASE_URL)
+        etag = resp.headers["ETag"]
+        resp = self.client.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self._create_customers(1)
+        resp = self.client.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 3)
+
+    def test_update_customer_if_match(self):
+        """It should update a Customer only if If-Match is current"""
+        customer = self._create_customers(1)[0]
+        etag = self.client.get(f"{BASE_URL}/{customer.id}").headers["ETag"]
+        customer.name = "first writer"
+        resp = self.client.put(
+            f"{BASE_URL}/{customer.id}", json=customer.serialize(), headers={"If-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+        # a second writer still holding the old ETag is rejected
+        customer.name = "second writer"
+        resp = self.client.put(
+            f"{BASE_URL}/{customer.id}", json=customer.serialize(), headers={"If-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        data = self.client.get(f"{BASE_URL}/{customer.id}").get_json()
+        self.assertEqual(data["name"], "first writer")
+
+    @patch.object(Customer, "update")
+    def test_update_customer_version_conflict(self, mock_update):
+        """It should return 412 when a concurrent update wins the race"""
+        mock_update.side_effect = VersionConflictError("changed by another request")
+        customer = self._create_customers(1)[0]
+        resp = self.client.put(f"{BASE_URL}/{customer.id}", json=customer.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertIn("changed by another request", resp.get_json()["message"])
+
+    def test_list_customers_sparse_fields(self):
+        """It should only return the requested fields of each Customer"""
+        self._create_customers(3)
+        resp = self.client.get(BASE_URL, query_string={"fields": "name,available"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        for customer in resp.get_json():
+            self.assertEqual(set(customer), {"id", "name", "available"})
+        full_etag = self.client.get(BASE_URL).headers["ETag"]
+        self.assertNotEqual(resp.headers["ETag"], full_etag)
+
+        resp = self.client.get(BASE_URL, query_string={"fields": "name", "limit": 2})
+        self.assertIn("fields=name", resp.headers["Link"])
+        self.assertEqual(len(resp.get_json()), 2)
+
+    def test_get_customer_sparse_fields(self):
+        """It should only return the requested fields of a Customer"""
+        customer = self._create_customers(1)[0]
+        customer_cache.clear()
+        resp = self.client.get(f"{BASE_URL}/{customer.id}", query_string={"fields": "email"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"id": customer.id, "email": customer.email})
+        etag = resp.headers["ETag"]
+        resp = self.client.get(
+            f"{BASE_URL}/{customer.id}", query_string={"fields": "email"}, headers={"If-None-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_get_customer_bad_fields(self):
+        """It should not return unknown fields"""
+        customer = self._create_customers(1)[0]
+        resp = self.client.get(f"{BASE_URL}/{customer.id}", query_string={"fields": "secret"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL, query_string={"fields": "secret"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,115 @@
+"""
+Test cases for the replica routing session
+"""
+import os
+import tempfile
+from unittest import TestCase
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from service.common.routing import RoutingSession, replica_health, watch_replicas
+
+
+class TestRoutingSession(TestCase):
+    """Test Cases for RoutingSession"""
+
+    def setUp(self):
+        self.paths = []
+        for _ in range(3):
+            handle, path = tempfile.mkstemp(suffix=".db")
+            os.close(handle)
+            self.paths.append(path)
+        primary, *replicas = self.paths
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{primary}"
+        self.app.config["SQLALCHEMY_BINDS"] = {
+            f"replica_{index}": f"sqlite:///{path}" for index, path in enumerate(replicas)
+        }
+        self.sql = SQLAlchemy(session_options={"class_": RoutingSession})
+        self.sql.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        watch_replicas(self.sql)
+        for engine in self.sql.engines.values():
+            with engine.begin() as conn:
+                conn.execute(text("CREATE TABLE source (name TEXT)"))
+        for key, engine in self.sql.engines.items():
+            with engine.begin() as conn:
+                conn.execute(text("INSERT INTO source VALUES (:name)"), {"name": key or "primary"})
+
+    def tearDown(self):
+        self.sql.session.remove()
+        for engine in self.sql.engines.values():
+            engine.dispose()
+        self.ctx.pop()
+        replica_health.reset()
+        for path in self.paths:
+            os.remove(path)
+
+    def _read(self):
+        return self.sql.session.execute(self.sql.select(text("name")).select_from(text("source"))).scalar()
+
+    def test_reads_round_robin(self):
+        """It should spread reads over the replicas"""
+        sources = {self._read() for _ in range(4)}
+        self.assertEqual(sources, {"replica_0", "replica_1"})
+
+    def test_reads_own_writes(self):
+        """It should stay on the primary after a write"""
+        self.sql.session.execute(text("INSERT INTO source VALUES ('written')"))
+        self.sql.session.commit()
+        self.assertEqual({self._read() for _ in range(4)}, {"primary"})
+        self.sql.session.close()
+        self.assertTrue(self._read().startswith("replica_"))
+
+    def test_use_replicas(self):
+        """It should read from the replicas again once unpinned"""
+        self.sql.session.execute(text("INSERT INTO source VALUES ('written')"))
+        self.assertEqual(self._read(), "primary")
+        self.sql.session.commit()
+        self.sql.session().use_replicas()
+        self.assertTrue(self._read().startswith("replica_"))
+
+    def test_no_failover_on_bad_query(self):
+        """It should not retry a read that failed for another reason than an unreachable replica"""
+        with self.assertRaises(OperationalError):
+            self.sql.session.execute(self.sql.select(text("name")).select_from(text("missing")))
+        self.sql.session.rollback()
+        self.assertTrue(replica_health.is_up("replica_0") and replica_health.is_up("replica_1"))
+
+    def test_use_primary(self):
+        """It should read from the primary when asked to"""
+        self.sql.session().use_primary()
+        self.assertEqual(self._read(), "primary")
+
+    def test_failover(self):
+        """It should fail over to the primary when the replicas are unhealthy"""
+        replica_health.mark_down("replica_0")
+        self.assertEqual({self._read() for _ in range(4)}, {"replica_1"})
+        replica_health.mark_down("replica_1")
+        self.assertEqual(self._read(), "primary")
+
+    def test_unreachable_replica(self):
+        """It should take a replica out of rotation when it cannot be reached"""
+        app = Flask(__name__)
+        app.config.update(self.app.config)
+        app.config["SQLALCHEMY_BINDS"] = {
+            "replica_0": "sqlite:////nonexistent/replica.db",
+            "replica_1": self.app.config["SQLALCHEMY_BINDS"]["replica_1"],
+        }
+        sql = SQLAlchemy(session_options={"class_": RoutingSession})
+        sql.init_app(app)
+        with app.app_context():
+            watch_replicas(sql)
+            for _ in range(2):
+                # the read that finds replica_0 down is answered elsewhere
+                self.assertEqual(sql.session.execute(sql.select(text("1"))).scalar(), 1)
+                sql.session.remove()
+            self.assertFalse(replica_health.is_up("replica_0"))
+            sql.session.remove()
+            source = sql.session.execute(sql.select(text("name")).select_from(text("source"))).scalar()
+            self.assertEqual(source, "replica_1")
+            sql.session.remove()
+            for engine in sql.engines.values():
+                engine.dispose()